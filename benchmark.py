@@ -0,0 +1,192 @@
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+import hipchannel
+import mockapi
+
+# Runs a full snapshot and sync against mockapi for each catalog size and reports throughput,
+# requests per sale, request latency and peak memory. Nothing here talks to the live stores.
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def expected_quantities(listings, products, sales, orders):
+    hipstamp = {listing['id']: listing['quantity'] for listing in listings}
+    channeladvisor = {product['ID']: product['TotalAvailableQuantity'] for product in products}
+    hipstamp_ids = {listing['name']: listing['id'] for listing in listings}
+    channeladvisor_ids = {product['Title']: product['ID'] for product in products}
+    for sale in sales:
+        for listing in sale['SaleListings']:
+            channeladvisor[channeladvisor_ids[listing['listing_name']]] -= listing['quantity']
+    for order in orders:
+        for item in order['Items']:
+            hipstamp[hipstamp_ids[item['Title']]] -= item['Quantity']
+    return hipstamp, channeladvisor
+
+def write_config(work_dir, endpoints, args):
+    start_time = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=2)).isoformat()
+    config = {
+        "CHANNEL_ADVISOR_DEVELOPER_KEY": "mock",
+        "HIPSTAMP_API_KEY": "mock",
+        "CHANNEL_ADVISOR_CLIENT_ID": "mock",
+        "CHANNEL_ADVISOR_CLIENT_SECRET": "mock",
+        "CHANNEL_ADVISOR_REFRESH_TOKEN": "mock",
+        "LAST_CHECKED_FILE_HIP": os.path.join(work_dir, "lastcheckedhip.txt"),
+        "LAST_CHECKED_FILE_CA": os.path.join(work_dir, "lastcheckedchannel.txt"),
+        "HIPSTAMP_INDEX_FILE": os.path.join(work_dir, "hipstamp_title_index.json"),
+        "CHANNEL_ADVISOR_INDEX_FILE": os.path.join(work_dir, "channeladvisor_title_index.json"),
+        "INVENTORY_DB_FILE": os.path.join(work_dir, "inventory_snapshots.db"),
+        "SALE_LEDGER_FILE": os.path.join(work_dir, "sale_ledger.db"),
+        "EVENT_LOG_FILE": os.path.join(work_dir, "sync_events.db"),
+        "HIPSTAMP_REQUESTS_PER_SECOND": args.requests_per_second,
+        "CHANNEL_ADVISOR_REQUESTS_PER_SECOND": args.requests_per_second,
+        "MAX_WORKERS": args.workers,
+        **endpoints,
+    }
+    for key in ("LAST_CHECKED_FILE_HIP", "LAST_CHECKED_FILE_CA"):
+        with open(config[key], 'w') as f:
+            f.write(start_time)
+    config_file = os.path.join(work_dir, "config.json")
+    with open(config_file, 'w') as f:
+        json.dump(config, f, indent=2)
+    return config_file
+
+def run_phase(func, latencies, trace_memory):
+    # Returns (seconds, peak traced memory in bytes or None, requests sent) for one call of func
+    del latencies[:]
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak, len(latencies)
+
+def megabytes(size):
+    return None if size is None else round(size / 1e6, 1)
+
+def mock_state(endpoints):
+    base_url = endpoints["HIPSTAMP_API_ENDPOINT"].rsplit("/", 1)[0]
+    with urllib.request.urlopen(f"{base_url}/mock/state") as response:
+        state = json.load(response)
+    # JSON object keys come back as strings
+    return state["stats"], ({int(key): value for key, value in state["hipstamp_quantities"].items()},
+                            {int(key): value for key, value in state["channeladvisor_quantities"].items()})
+
+def run_benchmark(skus, args, work_root):
+    work_dir = os.path.join(work_root, f"skus_{skus}")
+    os.makedirs(work_dir, exist_ok=True)
+    sales = args.sales if args.sales is not None else max(100, skus // 100)
+    catalog = mockapi.generate_catalog(skus, sales, sales, seed=args.seed)
+    expected = expected_quantities(*catalog)
+
+    # The mock runs in its own process so it neither competes for the GIL nor shows up in the memory figures
+    options = {"latency": args.latency, "jitter": args.jitter, "rate_limit_every": args.rate_limit_every,
+               "retry_after": args.retry_after, "failure_rate": args.failure_rate}
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=mockapi.serve, args=(catalog, options, ready), daemon=True)
+    server.start()
+    del catalog
+    try:
+        endpoints = ready.get(timeout=60)
+        engine = hipchannel.SyncEngine(write_config(work_dir, endpoints, args))
+        # Response.elapsed runs from sending the request to parsing the response headers
+        latencies = []
+        for session in hipchannel.sessions.values():
+            session.hooks["response"].append(lambda response, *hook_args, **hook_kwargs: latencies.append(response.elapsed.total_seconds()))
+
+        snapshot_seconds, snapshot_peak, snapshot_requests = run_phase(engine.snapshot, latencies, args.trace_memory)
+        sale_lines = []
+        sync_seconds, sync_peak, sync_requests = run_phase(lambda: sale_lines.append(engine.sync(refresh_inventory=False)), latencies, args.trace_memory)
+        sync_latencies = list(latencies)
+        stats, actual = mock_state(endpoints)
+        request_metrics = hipchannel.metrics.to_json()
+    finally:
+        server.terminate()
+        server.join()
+
+    wrong = sum(1 for expected_side, actual_side in zip(expected, actual)
+                for item_id, quantity in expected_side.items() if actual_side[item_id] != quantity)
+    num_lines = sale_lines[0]
+    return {
+        "skus": skus,
+        "sales": sales * 2,
+        "sale_lines": num_lines,
+        "snapshot_seconds": round(snapshot_seconds, 3),
+        "snapshot_requests": snapshot_requests,
+        "snapshot_peak_mb": megabytes(snapshot_peak),
+        "sync_seconds": round(sync_seconds, 3),
+        "sales_per_second": round(num_lines / sync_seconds, 1) if sync_seconds else None,
+        "requests_per_sale": round(sync_requests / num_lines, 2) if num_lines else None,
+        "latency_p50_ms": round(percentile(sync_latencies, 0.5) * 1000, 2) if sync_latencies else None,
+        "latency_p99_ms": round(percentile(sync_latencies, 0.99) * 1000, 2) if sync_latencies else None,
+        "latency_mean_ms": round(statistics.fmean(sync_latencies) * 1000, 2) if sync_latencies else None,
+        "sync_peak_mb": megabytes(sync_peak),
+        "server_requests": stats["total_requests"],
+        "server_bytes_sent": stats["bytes_sent"],
+        "rate_limited": stats["rate_limited"],
+        "injected_failures": stats["failed"],
+        "wrong_quantities": wrong,
+        "phases": request_metrics["phases"],
+        "endpoints": request_metrics["endpoints"],
+    }
+
+def print_table(results):
+    columns = ["skus", "sale_lines", "snapshot_seconds", "sync_seconds", "sales_per_second", "requests_per_sale",
+               "latency_p50_ms", "latency_p99_ms", "sync_peak_mb", "wrong_quantities"]
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in columns]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[column]).rjust(width) for column, width in zip(columns, widths)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark a full snapshot and sync against the mock APIs.")
+    parser.add_argument("--skus", type=int, nargs="+", default=[1000, 10000, 100000], help="catalog sizes to run")
+    parser.add_argument("--sales", type=int, default=None, help="sales waiting on each platform (default 1%% of the catalog, at least 100)")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds the mock adds to every response")
+    parser.add_argument("--jitter", type=float, default=0.002, help="random +/- seconds on top of --latency")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth request with a 429")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After seconds sent with each 429")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    parser.add_argument("--requests-per-second", type=float, default=1000, help="client rate limit for each platform")
+    parser.add_argument("--workers", type=int, default=8, help="MAX_WORKERS for the sync")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-trace-memory", dest="trace_memory", action="store_false",
+                        help="skip the peak memory figures; tracing roughly halves throughput")
+    parser.add_argument("--work-dir", help="keep the generated config, databases and log here instead of a temporary directory")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_root = args.work_dir or temp_dir
+        os.makedirs(work_root, exist_ok=True)
+        hipchannel.configure_logging(os.path.join(work_root, "sync_log.log"))
+        results = []
+        for skus in args.skus:
+            print(f"Running {skus} SKUs...", file=sys.stderr)
+            results.append(run_benchmark(skus, args, work_root))
+        logging.shutdown()
+
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+import argparse
+import sys
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Sync inventory between HipStamp and ChannelAdvisor.")
+    parser.add_argument("--config", default="config.json", help="path to config.json")
+    parser.add_argument("--log-file", default="sync_log.log", help="text log to write to")
+    parser.add_argument("--metrics-file", help="write request metrics here after each run (.json for a JSON summary, "
+                                               "anything else for Prometheus text); overrides METRICS_FILE")
+    parser.add_argument("--profile", metavar="FILE", help="profile the whole command with cProfile and save the stats to FILE")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = subparsers.add_parser("sync", help="apply new sales from each platform to the other once")
+    sync_parser.add_argument("--refresh-inventory", action="store_true", help="download both inventories before syncing")
+
+    compare_parser = subparsers.add_parser("compare", help="list products whose quantities or titles differ, as CSV")
+    compare_parser.add_argument("--no-refresh", action="store_true", help="compare the last inventory snapshots without downloading")
+    compare_parser.add_argument("--threshold", type=float, default=None, help="minimum trigram similarity for a fuzzy title match")
+    compare_parser.add_argument("--no-fuzzy", action="store_true", help="only match titles exactly or after normalization")
+    compare_parser.add_argument("--output", help="write the result to this file instead of stdout")
+
+    reconcile_parser = subparsers.add_parser("reconcile", help="set both platforms to one platform's quantities wherever they differ")
+    reconcile_parser.add_argument("--source", required=True, choices=["hipstamp", "channeladvisor"], help="the platform whose quantities are right")
+    reconcile_parser.add_argument("--dry-run", action="store_true", help="only list the changes that would be made")
+    reconcile_parser.add_argument("--include-fuzzy", action="store_true", help="also fix products matched by title similarity")
+    reconcile_parser.add_argument("--threshold", type=float, default=None, help="minimum trigram similarity for a fuzzy title match")
+    reconcile_parser.add_argument("--output", help="write the changes to this file instead of stdout")
+
+    subparsers.add_parser("snapshot", help="download both inventories into the snapshot store")
+
+    tenants_parser = subparsers.add_parser("sync-tenants", help="sync several store pairs in parallel, one process each")
+    tenants_parser.add_argument("tenants_file", help="JSON file mapping tenant names to their config.json files")
+    tenants_parser.add_argument("--workers", type=int, default=None, help="tenants synced at once (default 8)")
+    tenants_parser.add_argument("--refresh-inventory", action="store_true", help="download every tenant's inventories before syncing")
+    tenants_parser.add_argument("--output", help="also write the report as JSON to this file")
+    daemon_parser = subparsers.add_parser("daemon", help="keep polling for new sales until stopped")
+    daemon_parser.add_argument("--webhook-port", type=int, default=None, help="also apply sales pushed to this port as they arrive; overrides WEBHOOK_PORT")
+    subparsers.add_parser("gui", help="open the desktop app")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(run_command, args)
+        finally:
+            profiler.dump_stats(args.profile)
+            print(f"Profile saved to {args.profile}. Slowest functions by cumulative time:", file=sys.stderr)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(15)
+    return run_command(args)
+
+def run_command(args):
+    # Imported here so headless commands never load tkinter, and --help loads nothing
+    if args.command == "gui":
+        import hipchannelsync
+        hipchannelsync.main(args.config)
+        return 0
+
+    import hipchannel
+    import reconcile
+    hipchannel.configure_logging(args.log_file)
+    if args.command == "sync-tenants":
+        import json
+        import tenants
+        try:
+            rows, summary = tenants.sync_tenants(tenants.load_tenants(args.tenants_file), args.workers, args.refresh_inventory)
+        except hipchannel.ConfigError as e:
+            print(e, file=sys.stderr)
+            return 1
+        tenants.write_report(rows, summary, sys.stdout)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"tenants": rows, "summary": summary}, f, indent=2)
+        return 1 if summary["failed"] else 0
+
+    try:
+        engine = hipchannel.SyncEngine(args.config, metrics_file=args.metrics_file)
+        if args.command == "sync":
+            num_processed = engine.sync(refresh_inventory=args.refresh_inventory)
+            print(f"{num_processed} sale lines applied.")
+        elif args.command == "compare":
+            result = engine.compare(refresh=not args.no_refresh, fuzzy_threshold=args.threshold, fuzzy=not args.no_fuzzy)
+            if args.output:
+                with open(args.output, "w", newline="") as f:
+                    result.write_csv(f)
+            else:
+                result.write_csv(sys.stdout)
+            print(f"{len(result)} products need attention.", file=sys.stderr)
+        elif args.command == "reconcile":
+            source = "HipStamp" if args.source == "hipstamp" else "ChannelAdvisor"
+            changes = engine.reconcile(source, apply=not args.dry_run, include_fuzzy=args.include_fuzzy, fuzzy_threshold=args.threshold)
+            if args.output:
+                with open(args.output, "w", newline="") as f:
+                    reconcile.write_plan_csv(changes, f)
+            else:
+                reconcile.write_plan_csv(changes, sys.stdout)
+            skipped = sum(1 for change in changes if change['status'] == "skipped")
+            if args.dry_run:
+                print(f"{len(changes) - skipped} products would be updated, {skipped} skipped for a missing quantity.", file=sys.stderr)
+            else:
+                updated = sum(1 for change in changes if change['status'] == "updated")
+                print(f"{updated} products updated, {len(changes) - updated - skipped} failed, {skipped} skipped for a missing quantity.", file=sys.stderr)
+        elif args.command == "snapshot":
+            engine.snapshot()
+            print("Inventory snapshots updated.")
+        elif args.command == "daemon":
+            engine.run_daemon(webhook_port=args.webhook_port)
+    except (hipchannel.ConfigError, hipchannel.SyncError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
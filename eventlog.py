@@ -0,0 +1,92 @@
+import sqlite3
+import datetime
+import threading
+
+DECREMENTED = "decremented"
+NO_MATCH = "no_match"
+DUPLICATE = "duplicate"
+ERROR = "error"
+RECONCILED = "reconciled"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    level TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    platform TEXT,
+    title TEXT,
+    quantity INTEGER,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_by_type ON events (event_type, id);
+CREATE INDEX IF NOT EXISTS events_by_platform ON events (platform, id);
+CREATE INDEX IF NOT EXISTS events_by_title ON events (title);
+CREATE INDEX IF NOT EXISTS events_by_time ON events (created_at);
+"""
+
+class EventLog:
+    # Sync outcomes shown in the Log Viewer, one row per event. Shared by the update worker threads.
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_file, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, level, event_type, platform, title, message, quantity=None):
+        created_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO events (created_at, level, event_type, platform, title, quantity, message) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (created_at, level, event_type, platform, title, quantity, message))
+            self.connection.commit()
+
+    def _where(self, event_types, platform, search):
+        clauses, params = [], []
+        if event_types:
+            clauses.append(f"event_type IN ({', '.join('?' for _ in event_types)})")
+            params.extend(event_types)
+        if platform:
+            clauses.append("platform = ?")
+            params.append(platform)
+        if search:
+            clauses.append("message LIKE ?")
+            params.append(f"%{search}%")
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def count(self, event_types=None, platform=None, search=None):
+        where, params = self._where(event_types, platform, search)
+        with self.lock:
+            return self.connection.execute(f"SELECT COUNT(*) FROM events{where}", params).fetchone()[0]
+
+    def page(self, event_types=None, platform=None, search=None, before_id=None, offset=0, limit=500):
+        # Newest first; either pass the smallest id of the previous page as before_id, or an offset
+        where, params = self._where(event_types, platform, search)
+        if before_id is not None:
+            where += (" AND" if where else " WHERE") + " id < ?"
+            params.append(before_id)
+        with self.lock:
+            return self.connection.execute(
+                f"SELECT id, created_at, level, event_type, platform, title, quantity, message FROM events{where} ORDER BY id DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]).fetchall()
+
+    def delete(self, event_ids):
+        with self.lock:
+            self.connection.executemany("DELETE FROM events WHERE id = ?", [(event_id,) for event_id in event_ids])
+            self.connection.commit()
+
+    def prune(self, days):
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        with self.lock:
+            deleted = self.connection.execute("DELETE FROM events WHERE created_at < ?", (cutoff,)).rowcount
+            self.connection.commit()
+        return deleted
@@ -1,18 +1,36 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import datetime
 import logging
+import logging.handlers
+import os
+import eventlog
+import inventorystore
+import records
+import saleledger
+import telemetry
+import time
+import threading
+import concurrent.futures
+import email.utils
+import itertools
+import re
+import uuid
+import signal
+import sys
+import urllib.parse
 
-logging.basicConfig(filename='sync_log.log', level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+def configure_logging(log_file='sync_log.log', level=logging.INFO):
+    logging.basicConfig(handlers=[logging.handlers.RotatingFileHandler(log_file, maxBytes=5 * 1024 * 1024, backupCount=3)],
+                        level=level, format='%(asctime)s - %(levelname)s - %(message)s')
 
-try:
-    with open('config.json', 'r') as f:
-        config = json.load(f)
-    logging.info("Successfully read the config.json file.")
-except FileNotFoundError as e:
-    logging.error("Missing config.json file.")
-    exit(1)
+class ConfigError(Exception):
+    pass
+
+class SyncError(Exception):
+    pass
 
 required_keys = [
     "CHANNEL_ADVISOR_API_ENDPOINT", 
@@ -27,52 +45,284 @@ required_keys = [
     "HIPSTAMP_USERNAME"
 ]
 
-for key in required_keys:
-    if key not in config:
-        logging.error(f"Missing {key} in config.json")
-        exit(1)
+# Optional config.json settings and their defaults
+OPTIONAL_SETTINGS = {
+    "HIPSTAMP_INDEX_FILE": "hipstamp_title_index.json",
+    "CHANNEL_ADVISOR_INDEX_FILE": "channeladvisor_title_index.json",
+    "HIPSTAMP_REQUESTS_PER_SECOND": 5,
+    "CHANNEL_ADVISOR_REQUESTS_PER_SECOND": 10,
+    "MAX_RATE_LIMIT_RETRIES": 5,
+    "MAX_WORKERS": 8,
+    "REQUEST_TIMEOUT": (5, 30),
+    "MAX_SERVER_ERROR_RETRIES": 3,
+    "HIPSTAMP_PAGE_SIZE": 100,
+    "CHANNEL_ADVISOR_BATCH_SIZE": 100,
+    "INVENTORY_DB_FILE": "inventory_snapshots.db",
+    "FULL_SNAPSHOT_INTERVAL_HOURS": 24,
+    "DAEMON_POLL_SECONDS": 15,
+    "DAEMON_MAX_POLL_SECONDS": 120,
+    "DAEMON_INVENTORY_REFRESH_SECONDS": 3600,
+    "TOKEN_REFRESH_MARGIN_SECONDS": 300,
+    "TOKEN_CACHE_FILE": None,
+    "SALE_LEDGER_FILE": "sale_ledger.db",
+    "SALE_WATERMARK_OVERLAP_SECONDS": 600,
+    "HIPSTAMP_SALE_CREATED_FIELD": "created_at",
+    "EVENT_LOG_FILE": "sync_events.db",
+    "EVENT_RETENTION_DAYS": 90,
+    "CHANNEL_ADVISOR_TOKEN_URL": "https://api.channeladvisor.com/oauth2/token",
+    "METRICS_FILE": None,
+    "WEBHOOK_HOST": "127.0.0.1",
+    "WEBHOOK_PORT": None,
+    "WEBHOOK_SECRET": None,
+}
+
+# Constants from config, set by load_config(). Nothing is read from disk at import time.
+config = None
+CHANNEL_ADVISOR_API_ENDPOINT = None
+HIPSTAMP_API_ENDPOINT = None
+CHANNEL_ADVISOR_DEVELOPER_KEY = None
+HIPSTAMP_API_KEY = None
+LAST_CHECKED_FILE_HIP = None
+LAST_CHECKED_FILE_CA = None
+CHANNEL_ADVISOR_CLIENT_ID = None
+CHANNEL_ADVISOR_CLIENT_SECRET = None
+CHANNEL_ADVISOR_REFRESH_TOKEN = None
+HIPSTAMP_USERNAME = None
+globals().update(OPTIONAL_SETTINGS)
+
+def load_config(config_file='config.json'):
+    global config
+    try:
+        with open(config_file, 'r') as f:
+            loaded = json.load(f)
+        logging.info(f"Successfully read the {config_file} file.")
+    except FileNotFoundError:
+        logging.error(f"Missing {config_file} file.")
+        raise ConfigError(f"Missing {config_file} file.")
+
+    for key in required_keys:
+        if key not in loaded:
+            logging.error(f"Missing {key} in {config_file}")
+            raise ConfigError(f"Missing {key} in {config_file}")
+
+    settings = {key: loaded[key] for key in required_keys}
+    settings.update({key: loaded.get(key, default) for key, default in OPTIONAL_SETTINGS.items()})
+    settings["REQUEST_TIMEOUT"] = tuple(settings["REQUEST_TIMEOUT"])
+    globals().update(settings)
+    config = loaded
+    reset_state()
+
+def ensure_config():
+    if config is None:
+        load_config()
+
+event_log = None
+event_log_lock = threading.Lock()
+
+def get_event_log():
+    global event_log
+    ensure_config()
+    with event_log_lock:
+        if event_log is None:
+            event_log = eventlog.EventLog(EVENT_LOG_FILE)
+        return event_log
+
+def record_event(level, event_type, platform, title, message, quantity=None):
+    # Outcomes the Log Viewer shows go to the event log as well as the text log
+    logging.log(level, message)
+    get_event_log().record(logging.getLevelName(level), event_type, platform, title, message, quantity)
+    emit_progress("event", event_type=event_type, platform=platform, title=title, message=message)
+
+# Callers running a sync on another thread (the GUI) watch it through progress listeners and stop it
+# through cancel_event. A cancelled sync stops between items and pages and raises SyncCancelled;
+# anything already applied is in the sale ledger, so the next run carries on from there.
+progress_listeners = []
+cancel_event = threading.Event()
+
+class SyncCancelled(Exception):
+    pass
+
+# Held while sale lines are checked against the ledger and applied (but not while sales are fetched),
+# so the polling sweep and the webhook receiver never both apply the same sale line
+apply_lock = threading.Lock()
+
+def add_progress_listener(listener):
+    progress_listeners.append(listener)
+
+def remove_progress_listener(listener):
+    progress_listeners.remove(listener)
+
+def emit_progress(kind, **details):
+    for listener in list(progress_listeners):
+        listener(kind, details)
+
+def check_cancelled():
+    if cancel_event.is_set():
+        raise SyncCancelled("Sync cancelled.")
+
+def load_title_index(index_file):
+    try:
+        with open(index_file, 'r') as f:
+            index = {title: [records.InventoryItem(entry['id'], title, entry.get('quantity')) for entry in entries]
+                     for title, entries in json.load(f).items()}
+        logging.info(f"Loaded {len(index)} titles from {index_file}.")
+        return index
+    except FileNotFoundError:
+        logging.warning(f"{index_file} not found. Starting with an empty title index.")
+        return {}
+    except json.JSONDecodeError as e:
+        logging.error(f"Could not parse {index_file}, starting with an empty title index: {e}")
+        return {}
+
+def save_title_index(index_file, index):
+    temp_file = f"{index_file}.tmp"
+    with open(temp_file, 'w') as f:
+        json.dump({title: [entry.to_index_entry() for entry in entries] for title, entries in index.items()}, f)
+    os.replace(temp_file, index_file)
 
-# Constants from config
-CHANNEL_ADVISOR_API_ENDPOINT = config["CHANNEL_ADVISOR_API_ENDPOINT"]
-HIPSTAMP_API_ENDPOINT = config["HIPSTAMP_API_ENDPOINT"]
-CHANNEL_ADVISOR_DEVELOPER_KEY = config["CHANNEL_ADVISOR_DEVELOPER_KEY"]
-HIPSTAMP_API_KEY = config["HIPSTAMP_API_KEY"]
-LAST_CHECKED_FILE_HIP = config["LAST_CHECKED_FILE_HIP"]
-LAST_CHECKED_FILE_CA = config["LAST_CHECKED_FILE_CA"]
-CHANNEL_ADVISOR_CLIENT_ID = config["CHANNEL_ADVISOR_CLIENT_ID"]
-CHANNEL_ADVISOR_CLIENT_SECRET = config["CHANNEL_ADVISOR_CLIENT_SECRET"]
-CHANNEL_ADVISOR_REFRESH_TOKEN = config["CHANNEL_ADVISOR_REFRESH_TOKEN"]
-HIPSTAMP_USERNAME = config["HIPSTAMP_USERNAME"]
+def build_title_index(items, title_key, id_key, quantity_key=None):
+    # Every title maps to a list of entries so duplicate titles stay visible instead of
+    # one listing silently overwriting another.
+    index = {}
+    for item in items:
+        title = item.get(title_key)
+        if title is None or id_key not in item:
+            continue
+        quantity = item.get(quantity_key) if quantity_key is not None else None
+        index.setdefault(title, []).append(records.InventoryItem(item[id_key], title, quantity))
+    return index
+
+def refresh_title_index(index_file, items, title_key, id_key, quantity_key=None):
+    old_index = load_title_index(index_file)
+    new_index = build_title_index(items, title_key, id_key, quantity_key)
+    added = new_index.keys() - old_index.keys()
+    removed = old_index.keys() - new_index.keys()
+    changed = [title for title in new_index.keys() & old_index.keys() if new_index[title] != old_index[title]]
+    if added or removed or changed:
+        save_title_index(index_file, new_index)
+    duplicates = sum(1 for entries in new_index.values() if len(entries) > 1)
+    logging.info(f"Refreshed {index_file}: {len(added)} added, {len(removed)} removed, {len(changed)} changed, {duplicates} duplicate titles.")
+    return new_index
+
+def fetch_page(platform, url, headers, params):
+    response = send_request(platform, "GET", url, headers=headers, params=params)
+    response.raise_for_status()
+    return response.json()
+
+def iter_pages(platform, url, headers, params, next_page):
+    # The next page is requested in the background while the caller works through the current one
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as prefetcher:
+        future = prefetcher.submit(fetch_page, platform, url, headers, params)
+        while future is not None:
+            page = future.result()
+            emit_progress("page", platform=platform, url=url)
+            following = next_page(page, url, params)
+            if following is None:
+                future = None
+            else:
+                url, params = following
+                future = prefetcher.submit(fetch_page, platform, url, headers, params)
+            check_cancelled()
+            yield page
+
+def next_hipstamp_page(page, url, params, seen):
+    # seen counts the results on this page and the ones before. The server may cap limit below what
+    # was asked for, so a short page only ends the listing when the response carries no count.
+    results = page.get('results', [])
+    if not results:
+        return None
+    count = page.get('count')
+    if count is None:
+        if len(results) < params['limit']:
+            return None
+    elif seen >= count:
+        return None
+    return url, {**params, 'page': params['page'] + 1}
+
+def next_channeladvisor_page(page, url, params):
+    # nextLink already carries the original query options
+    next_link = page.get('@odata.nextLink')
+    if not next_link:
+        return None
+    return next_link, None
+
+def iter_hipstamp_pages(url, headers, params=None):
+    params = {**(params or {}), 'page': 1, 'limit': HIPSTAMP_PAGE_SIZE}
+    seen = 0
+
+    def next_page(page, url, params):
+        nonlocal seen
+        seen += len(page.get('results', []))
+        return next_hipstamp_page(page, url, params, seen)
+    return iter_pages("HipStamp", url, headers, params, next_page)
+
+def iter_channeladvisor_pages(url, headers, params=None):
+    return iter_pages("ChannelAdvisor", url, headers, params, next_channeladvisor_page)
+
+def iter_records(pages, key):
+    for page in pages:
+        yield from page.get(key, [])
+
+def load_inventory_snapshot(platform):
+    # Read from the stored columns, so the full records are never parsed
+    ensure_config()
+    with inventorystore.InventoryStore(INVENTORY_DB_FILE) as store:
+        for sku, title, quantity in store.iter_summaries(platform):
+            yield records.InventoryItem(sku, title, quantity)
+
+def needs_full_snapshot(store, platform):
+    last_full = store.last_snapshot_time(platform, full_only=True)
+    if last_full is None:
+        return True
+    last_full_time = datetime.datetime.strptime(last_full, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=datetime.timezone.utc)
+    return datetime.datetime.now(datetime.timezone.utc) - last_full_time >= datetime.timedelta(hours=FULL_SNAPSHOT_INTERVAL_HOURS)
 
 def log_current_hipstamp_inventory():
+    ensure_config()
+    # The HipStamp listings endpoint has no modified-since filter, so every snapshot is a full one
     url = f"{HIPSTAMP_API_ENDPOINT}/stores/{HIPSTAMP_USERNAME}/listings/active"
     headers = {
         "Content-Type": "application/json",
         "X-ApiKey": HIPSTAMP_API_KEY,
     }
     try:
-        response = requests.get(url, headers=headers)
-        logging.info(f"HipStamp request URL: {response.url}")
-        response.raise_for_status()
-        with open('hipstamp_inventory_backup.json', 'w') as f:
-            json.dump(response.json(), f)
+        with inventorystore.InventoryStore(INVENTORY_DB_FILE) as store:
+            items = iter_records(iter_hipstamp_pages(url, headers), 'results')
+            store.record_snapshot("HipStamp", items, 'id', 'name', 'quantity', full=True)
+            index = refresh_title_index(HIPSTAMP_INDEX_FILE, store.iter_items("HipStamp"), 'name', 'id', 'quantity')
         logging.info("Successfully logged current HipStamp inventory.")
+        return index
     except requests.RequestException as e:
         logging.error(f"Failed to log current HipStamp inventory: {e}")
-        logging.error(f"Response content: {response.content}")
-        logging.error(f"Status code: {response.status_code}")
+        if e.response is not None:
+            logging.error(f"Response content: {e.response.content}")
+            logging.error(f"Status code: {e.response.status_code}")
+        return load_title_index(HIPSTAMP_INDEX_FILE)
 
-def log_current_channeladvisor_inventory(access_token):
+def log_current_channeladvisor_inventory(access_token, full=False):
+    ensure_config()
     url = f"{CHANNEL_ADVISOR_API_ENDPOINT}/v1/Products"
     headers = {"Authorization": f"Bearer {access_token}"}
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        with open('channeladvisor_inventory_backup.json', 'w') as f:
-            json.dump(response.json(), f)
+        with inventorystore.InventoryStore(INVENTORY_DB_FILE) as store:
+            # Between full snapshots only products modified since the previous snapshot are fetched.
+            # ChannelAdvisor records quantity changes in QuantityUpdateDateUtc only, so both are checked.
+            # Deleted products only drop out on the next full snapshot.
+            full = full or needs_full_snapshot(store, "ChannelAdvisor")
+            if full:
+                params = None
+            else:
+                since = store.last_snapshot_time('ChannelAdvisor')
+                params = {'$filter': f"UpdateDateUtc ge {since} or QuantityUpdateDateUtc ge {since}"}
+            taken_at = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            items = iter_records(iter_channeladvisor_pages(url, headers, params), 'value')
+            store.record_snapshot("ChannelAdvisor", items, 'ID', 'Title', 'TotalAvailableQuantity', full=full, taken_at=taken_at)
+            index = refresh_title_index(CHANNEL_ADVISOR_INDEX_FILE, store.iter_items("ChannelAdvisor"), 'Title', 'ID')
         logging.info("Successfully logged current ChannelAdvisor inventory.")
+        return index
     except requests.RequestException as e:
         logging.error(f"Failed to log current ChannelAdvisor inventory: {e}")
+        return load_title_index(CHANNEL_ADVISOR_INDEX_FILE)
 
 def get_last_checked_time(file_name):
     try:
@@ -84,36 +334,85 @@ def get_last_checked_time(file_name):
         logging.warning(f"{file_name} not found. Setting last checked time to None.")
         return None
 
-def update_last_checked_time(file_name):
-    current_time = datetime.datetime.now().isoformat()
-    with open(file_name, "w") as f:
-        f.write(current_time)
-    logging.info(f"Updated last checked time in {file_name} to {current_time}.")
+def get_sync_start_time(platform, ledger=None):
+    # The ledger's watermark replaces the lastchecked*.txt files; those are only read to seed it once
+    if ledger is None:
+        ensure_config()
+        with saleledger.SaleLedger(SALE_LEDGER_FILE) as ledger:
+            return get_sync_start_time(platform, ledger)
+    watermark = ledger.get_watermark(platform)
+    if watermark is None:
+        last_checked_file = LAST_CHECKED_FILE_HIP if platform == "HipStamp" else LAST_CHECKED_FILE_CA
+        watermark = get_last_checked_time(last_checked_file)
+        if watermark is None:
+            watermark = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            logging.warning(f"No {platform} sync start time recorded. Checking for sales from now on.")
+        ledger.set_watermark(platform, watermark)
+    return watermark
+
+def set_sync_start_time(platform, created_since):
+    datetime.datetime.fromisoformat(created_since)
+    ensure_config()
+    with saleledger.SaleLedger(SALE_LEDGER_FILE) as ledger:
+        ledger.set_watermark(platform, created_since)
+    logging.info(f"Set {platform} sync start time to {created_since}.")
+
+def fetch_window_start(watermark):
+    # Sales are fetched from a little before the watermark so late-indexed sales are not missed;
+    # the ledger filters out the ones that were already applied.
+    start = to_utc(watermark) - datetime.timedelta(seconds=SALE_WATERMARK_OVERLAP_SECONDS)
+    return start.isoformat()
+
+def newest_created_time(sales, watermark):
+    newest = watermark
+    for sale in sales:
+        created = sale.created
+        if not created:
+            logging.warning(f"Sale without a creation time does not move the sync start time: {sale}")
+            continue
+        try:
+            if newest is None or to_utc(created) > to_utc(newest):
+                newest = created
+        except ValueError:
+            logging.warning(f"Could not parse sale creation time {created}.")
+    return newest
+
+def to_utc(timestamp):
+    parsed = datetime.datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
 
 def fetch_hipstamp_sales(last_checked_time):
     formatted_time = datetime.datetime.fromisoformat(last_checked_time).strftime('%Y-%m-%dT%H:%M:%SZ')
-    url = f"{HIPSTAMP_API_ENDPOINT}/stores/{HIPSTAMP_USERNAME}/sales/paid?created_time_from={formatted_time}"
+    url = f"{HIPSTAMP_API_ENDPOINT}/stores/{HIPSTAMP_USERNAME}/sales/paid"
     headers = {
         "Content-Type": "application/json",
         "X-ApiKey": HIPSTAMP_API_KEY,
     }
+    params = {'created_time_from': formatted_time}
+    pages = iter_hipstamp_pages(url, headers, params)
     try:
-        response = requests.get(url, headers=headers)
-        print(response.url)
-        response.raise_for_status()
-        sales_data = response.json()
-        if not all('SaleListings' in sale for sale in sales_data.get('results', [])):
-            logging.error("Some sale objects do not contain 'SaleListings'.")
-            return None
-
-        for sale in sales_data.get('results', []):
-            for listing in sale.get('SaleListings', []):
-                listing['title'] = listing.pop('listing_name', None)
-        logging.info(f"HipStamp sales response: {sales_data}")
-        return sales_data
+        first_page = next(pages)
     except requests.RequestException as e:
         logging.error(f"Error fetching HipStamp sales: {e}")
         return None
+    if not validate_response(first_page, ['results'], 'HipStamp'):
+        return None
+    return iter_hipstamp_sales(itertools.chain([first_page], pages))
+
+def iter_hipstamp_sales(pages):
+    # Yields the sales of one page at a time, as records.Sale, so callers never hold the whole window
+    # or the raw responses in memory
+    for page in pages:
+        logging.debug(f"HipStamp sales response: {page}")
+        sales = []
+        for sale in page.get('results', []):
+            if 'SaleListings' not in sale:
+                logging.error(f"Sale object does not contain 'SaleListings'. Skipping sale: {sale}")
+                continue
+            sales.append(records.parse_hipstamp_sale(sale, HIPSTAMP_SALE_CREATED_FIELD))
+        yield sales
 
 def fetch_channeladvisor_sales(last_checked_time_ca, access_token):
     formatted_time = datetime.datetime.fromisoformat(last_checked_time_ca).strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -123,136 +422,556 @@ def fetch_channeladvisor_sales(last_checked_time_ca, access_token):
         '$filter': f'CreatedDateUtc ge {formatted_time}',
         '$expand': 'Items'
     }
+    pages = iter_channeladvisor_pages(url, headers, params)
     try:
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        sales_data = response.json()
-        logging.info(f"ChannelAdvisor sales data fetched: {sales_data}")
-        return sales_data
+        first_page = next(pages)
     except requests.RequestException as e:
         logging.error(f"Error fetching ChannelAdvisor sales: {e}")
         return None
+    if not validate_response(first_page, ['value'], 'ChannelAdvisor'):
+        return None
+    return iter_channeladvisor_sales(itertools.chain([first_page], pages))
 
-def update_channeladvisor_quantity(sale_listings, access_token):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    for listing in sale_listings:
-        product_title = listing.get('title', '')
+def iter_channeladvisor_sales(pages):
+    for page in pages:
+        logging.debug(f"ChannelAdvisor sales data fetched: {page}")
+        yield [records.parse_channeladvisor_sale(sale) for sale in page.get('value', [])]
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Returns how long the caller had to wait
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        # Drain the bucket so every worker on this platform backs off, not just the one that got the 429
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+rate_limiters = {
+    "HipStamp": TokenBucket(HIPSTAMP_REQUESTS_PER_SECOND),
+    "ChannelAdvisor": TokenBucket(CHANNEL_ADVISOR_REQUESTS_PER_SECOND),
+}
+
+def create_session():
+    # Only idempotent methods are retried on server errors; a retried POST could apply a decrement twice.
+    # 429s are left to send_request so the platform's token bucket backs off as well.
+    retry = Retry(
+        total=MAX_SERVER_ERROR_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=["GET", "PUT", "DELETE", "HEAD", "OPTIONS"],
+        raise_on_status=False,
+        respect_retry_after_header=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(MAX_WORKERS, 1), max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    return session
+
+sessions = {
+    "HipStamp": create_session(),
+    "ChannelAdvisor": create_session(),
+}
+
+def get_retry_after(response):
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is None:
+        return 1
+    try:
+        return max(0, float(retry_after))
+    except ValueError:
         try:
-            sold_quantity = listing['quantity']
-        except KeyError:
-            logging.error(f"'quantity' key missing from listing. Full listing data: {listing}")
-            continue
+            retry_time = email.utils.parsedate_to_datetime(retry_after)
+            return max(0, (retry_time - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return 1
 
-        if isinstance(sold_quantity, str):
-            try:
-                sold_quantity = int(sold_quantity)
-            except ValueError:
-                logging.error(f"Failed to convert sold_quantity to int. Original value: {sold_quantity}")
-                continue
-        elif not isinstance(sold_quantity, (int, float)):
-            logging.error(f"Unexpected data type for sold_quantity. Expected int or float, got {type(sold_quantity)} with value: {sold_quantity}")
-            continue
+metrics = telemetry.Metrics()
+
+def endpoint_name(platform, url):
+    # Metric label for a URL: the path below the platform's API endpoint, with IDs replaced so
+    # every listing or product shares one label
+    base = HIPSTAMP_API_ENDPOINT if platform == "HipStamp" else CHANNEL_ADVISOR_API_ENDPOINT
+    if base and url.startswith(base):
+        url = url[len(base):]
+    path = urllib.parse.urlsplit(url).path
+    path = re.sub(r"\(\d+\)", "({id})", path)
+    return re.sub(r"/\d+(?=/|$)", "/{id}", path)
 
-        # Step 1: Look up the product by title
-        url_lookup = f"{CHANNEL_ADVISOR_API_ENDPOINT}/v1/Products"
-        replaced_title = product_title.replace("'", "''")
-        params = {'$filter': f"Title eq '{replaced_title}'"}
+def record_response(platform, endpoint, method, response, seconds):
+    body = response.request.body or b""
+    bytes_sent = len(body.encode() if isinstance(body, str) else body)
+    metrics.observe_request(platform, endpoint, method, response.status_code, seconds, bytes_sent, len(response.content))
+    # Server errors are retried inside the session's adapter; the response carries how often
+    retries = getattr(response.raw, "retries", None)
+    if retries is not None and retries.history:
+        metrics.count_retry(platform, endpoint, "server_error", len(retries.history))
+
+def write_metrics(metrics_file=None):
+    metrics_file = metrics_file or METRICS_FILE
+    if not metrics_file:
+        return
+    try:
+        metrics.write(metrics_file)
+    except OSError as e:
+        logging.error(f"Could not write metrics to {metrics_file}: {e}")
+
+def send_request(platform, method, url, **kwargs):
+    limiter = rate_limiters[platform]
+    session = sessions[platform]
+    endpoint = endpoint_name(platform, url)
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    headers = kwargs.get("headers") or {}
+    if platform == "ChannelAdvisor" and token_cache["previous_token"] is not None \
+            and headers.get("Authorization") == f"Bearer {token_cache['previous_token']}":
+        # The caller built its headers before the token was last refreshed
+        kwargs["headers"] = {**headers, "Authorization": f"Bearer {token_cache['access_token']}"}
+    rate_limit_retries = 0
+    retried_unauthorized = False
+    while True:
+        metrics.add_rate_limit_wait(platform, limiter.acquire())
+        started = time.perf_counter()
         try:
-            response_lookup = requests.get(url_lookup, headers=headers, params=params)
-            response_lookup.raise_for_status()
-            products = response_lookup.json().get('value', [])
-            if len(products) == 0:
-                logging.warning(f"No matching product found in ChannelAdvisor for product '{product_title}'. Did not decrement.[DISPLAY]")
-                continue
-            elif len(products) > 1:
-                logging.warning(f"Multiple matching products found in ChannelAdvisor for product '{product_title}'. Did not decrement.[DISPLAY]")
-                continue
-            product_id = products[0]['ID']
+            response = session.request(method, url, **kwargs)
         except requests.RequestException as e:
-            logging.error(f"Error looking up product by title in ChannelAdvisor: {e}[DISPLAY]")
-            continue
+            metrics.count_error(platform, endpoint, type(e).__name__)
+            raise
+        record_response(platform, endpoint, method, response, time.perf_counter() - started)
+        if response.status_code == 401 and platform == "ChannelAdvisor" and not retried_unauthorized:
+            retried_unauthorized = True
+            authorization = (kwargs.get("headers") or {}).get("Authorization", "")
+            if authorization.startswith("Bearer "):
+                access_token = get_access_token(stale_token=authorization[len("Bearer "):])
+                if access_token is not None:
+                    logging.warning(f"ChannelAdvisor rejected the access token on {method} {url}. Retrying with a refreshed token.")
+                    kwargs["headers"] = {**kwargs["headers"], "Authorization": f"Bearer {access_token}"}
+                    metrics.count_retry(platform, endpoint, "unauthorized")
+                    continue
+        if response.status_code != 429 or rate_limit_retries == MAX_RATE_LIMIT_RETRIES:
+            if response.status_code >= 400:
+                metrics.count_error(platform, endpoint, f"HTTP {response.status_code}")
+            return response
+        metrics.count_retry(platform, endpoint, "rate_limit")
+        rate_limit_retries += 1
+        wait = get_retry_after(response)
+        logging.warning(f"{platform} rate limit hit on {method} {url}. Retrying in {wait} seconds.")
+        limiter.pause(wait)
+
+def run_grouped(items, key_func, work_func):
+    # Items sharing a key run one after another on the same worker, so two decrements
+    # of the same product can never race; different products run in parallel.
+    groups = {}
+    for item in items:
+        groups.setdefault(key_func(item), []).append(item)
+
+    def run_group(group):
+        for item in group:
+            if cancel_event.is_set():
+                return
+            work_func(item)
+
+    if MAX_WORKERS <= 1 or len(groups) <= 1:
+        for group in groups.values():
+            run_group(group)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [executor.submit(run_group, group) for group in groups.values()]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                record_event(logging.ERROR, eventlog.ERROR, None, None, f"Unexpected error while updating inventory: {e}")
+
+def build_batch_body(boundary, requests_to_send):
+    lines = []
+    for content_id, (method, path, payload) in enumerate(requests_to_send, start=1):
+        lines += [
+            f"--{boundary}",
+            "Content-Type: application/http",
+            "Content-Transfer-Encoding: binary",
+            f"Content-ID: {content_id}",
+            "",
+            f"{method} {path} HTTP/1.1",
+            "Content-Type: application/json",
+            "",
+            json.dumps(payload),
+        ]
+    lines.append(f"--{boundary}--")
+    return "\r\n".join(lines) + "\r\n"
+
+def parse_batch_response(response):
+    # Returns {content_id: status_code} for every part of a multipart/mixed $batch response
+    match = re.search(r'boundary="?([^";]+)"?', response.headers.get("Content-Type", ""))
+    if match is None:
+        logging.error(f"ChannelAdvisor batch response has no multipart boundary: {response.text}")
+        return {}
+    statuses = {}
+    for position, part in enumerate(response.text.split(f"--{match.group(1)}")[1:-1], start=1):
+        status = re.search(r"HTTP/1\.1 (\d{3})", part)
+        content_id = re.search(r"Content-ID:\s*(\d+)", part, re.IGNORECASE)
+        key = int(content_id.group(1)) if content_id else position
+        statuses[key] = int(status.group(1)) if status else None
+    return statuses
 
-        # Step 2: Update the product quantity
-        url_update = f"{CHANNEL_ADVISOR_API_ENDPOINT}/v1/Products({product_id})/UpdateQuantity"
-        payload = {
-            "Value": {
-                "UpdateType": "UnShipped",
-                "CompleteDCList": "False",
-                "Updates": [
-                    {
-                        "DistributionCenterID": 0,
-                        "Quantity": -sold_quantity
-                    }
-                ]
-            }
+def quantity_payload(update_type, quantity):
+    return {
+        "Value": {
+            "UpdateType": update_type,
+            "CompleteDCList": "False",
+            "Updates": [
+                {
+                    "DistributionCenterID": 0,
+                    "Quantity": quantity
+                }
+            ]
         }
+    }
+
+def post_channeladvisor_updates(updates, headers):
+    # Sends [(product_id, payload)] as one $batch request and returns {product_id: status}.
+    # Raises requests.RequestException if the batch as a whole fails.
+    requests_to_send = [("POST", f"/v1/Products({product_id})/UpdateQuantity", payload) for product_id, payload in updates]
+    boundary = f"batch_{uuid.uuid4()}"
+    batch_headers = {**headers, "Content-Type": f"multipart/mixed; boundary={boundary}"}
+    response = send_request("ChannelAdvisor", "POST", f"{CHANNEL_ADVISOR_API_ENDPOINT}/v1/$batch",
+                            headers=batch_headers, data=build_batch_body(boundary, requests_to_send))
+    response.raise_for_status()
+    statuses = parse_batch_response(response)
+    return {product_id: statuses.get(content_id) for content_id, (product_id, _) in enumerate(updates, start=1)}
+
+def update_channeladvisor_quantity(sale_lines, access_token, title_index=None, ledger=None):
+    if title_index is None:
+        title_index = {}
+    if not title_index:
+        # Start from the saved index, so saving below never replaces it with just this call's lookups
+        title_index.update(load_title_index(CHANNEL_ADVISOR_INDEX_FILE))
+    index_lock = threading.Lock()
+    index_changed = False
+    headers = {"Authorization": f"Bearer {access_token}"}
+    sold_by_product = {}
+    num_applied = 0
+
+    def give_up(line, event_type, message):
+        record_event(logging.WARNING, event_type, "ChannelAdvisor", line.title, message)
+        if ledger is not None:
+            ledger.mark_failed("HipStamp", line.ledger_key, event_type)
+
+    def resolve_line(line):
+        nonlocal index_changed
+        product_title = line.title
+
+        # Step 1: Look up the product by title, using the local index before the API
+        entries = title_index.get(product_title)
+        if entries is not None and len(entries) > 1:
+            give_up(line, eventlog.DUPLICATE, f"Multiple matching products found in ChannelAdvisor for product '{product_title}'. Did not decrement.")
+            return
+        elif entries:
+            product_id = entries[0].id
+        else:
+            url_lookup = f"{CHANNEL_ADVISOR_API_ENDPOINT}/v1/Products"
+            replaced_title = product_title.replace("'", "''")
+            params = {'$filter': f"Title eq '{replaced_title}'"}
+            try:
+                response_lookup = send_request("ChannelAdvisor", "GET", url_lookup, headers=headers, params=params)
+                response_lookup.raise_for_status()
+                products = response_lookup.json().get('value', [])
+                if len(products) == 0:
+                    give_up(line, eventlog.NO_MATCH, f"No matching product found in ChannelAdvisor for product '{product_title}'. Did not decrement.")
+                    return
+                with index_lock:
+                    title_index[product_title] = [records.InventoryItem(product['ID'], product_title) for product in products]
+                    index_changed = True
+                if len(products) > 1:
+                    give_up(line, eventlog.DUPLICATE, f"Multiple matching products found in ChannelAdvisor for product '{product_title}'. Did not decrement.")
+                    return
+                product_id = products[0]['ID']
+            except requests.RequestException as e:
+                record_event(logging.ERROR, eventlog.ERROR, "ChannelAdvisor", product_title, f"Error looking up product by title in ChannelAdvisor: {e}")
+                return
+
+        with index_lock:
+            sold_by_product.setdefault(product_id, []).append(line)
+
+    run_grouped(sale_lines, lambda line: line.title, resolve_line)
+
+    if index_changed:
+        save_title_index(CHANNEL_ADVISOR_INDEX_FILE, title_index)
+    check_cancelled()
+
+    # Step 2: Update the product quantities, one net decrement per product, sent in $batch requests
+    product_ids = list(sold_by_product)
+    batches = [product_ids[i:i + CHANNEL_ADVISOR_BATCH_SIZE] for i in range(0, len(product_ids), CHANNEL_ADVISOR_BATCH_SIZE)]
+    logging.info(f"Sending {len(sale_lines)} ChannelAdvisor sale listings as {len(product_ids)} product updates in {len(batches)} batch requests.")
+
+    def send_batch(batch):
+        nonlocal num_applied
+        updates = []
+        for product_id in batch:
+            total_sold = sum(line.quantity for line in sold_by_product[product_id])
+            updates.append((product_id, quantity_payload("UnShipped", -total_sold)))
         try:
-            response = requests.post(url_update, headers=headers, json=payload)
-            response.raise_for_status()
-            logging.info(f"Updated ChannelAdvisor inventory for product {product_title}. Decremented by {sold_quantity}.[DISPLAY]")
+            statuses = post_channeladvisor_updates(updates, headers)
         except requests.RequestException as e:
-            logging.error(f"Failed to update ChannelAdvisor inventory for product {product_title}: {e}[DISPLAY]")
+            for product_id in batch:
+                for line in sold_by_product[product_id]:
+                    record_event(logging.ERROR, eventlog.ERROR, "ChannelAdvisor", line.title, f"Failed to update ChannelAdvisor inventory for product {line.title}: {e}")
+            return
+
+        # Map each product's result back to the individual sales that made up its decrement
+        for product_id in batch:
+            status = statuses.get(product_id)
+            for line in sold_by_product[product_id]:
+                if status is not None and 200 <= status < 300:
+                    if ledger is not None:
+                        ledger.mark_applied("HipStamp", line.ledger_key)
+                    with index_lock:
+                        num_applied += 1
+                    record_event(logging.INFO, eventlog.DECREMENTED, "ChannelAdvisor", line.title, f"Updated ChannelAdvisor inventory for product {line.title}. Decremented by {line.quantity}.", line.quantity)
+                else:
+                    record_event(logging.ERROR, eventlog.ERROR, "ChannelAdvisor", line.title, f"Failed to update ChannelAdvisor inventory for product {line.title}: batch item returned status {status}")
 
-def update_hipstamp_quantity(sale_listings):
-    for listing in sale_listings:
-        for item in listing.get('Items', []):
-            new_quantity = item['Quantity']
-            product_title = item.get('Title', '')
+    run_grouped(batches, lambda batch: batch[0], send_batch)
+    return num_applied
 
-            # Step 1: Look up the product by title
-            url_check = f"{HIPSTAMP_API_ENDPOINT}/stores/{HIPSTAMP_USERNAME}/listings/active?keywords={product_title}"
-            params_check = {'api_key': HIPSTAMP_API_KEY}
+# Outcomes retrying will not change. Sale lines ending this way are recorded in the ledger and set
+# aside, rather than looked up and logged again every cycle while they are in the fetch window.
+PERMANENT_FAILURES = (eventlog.NO_MATCH, eventlog.DUPLICATE)
+
+def put_hipstamp_quantity(listing_id, quantity):
+    url = f"{HIPSTAMP_API_ENDPOINT}/listings/{listing_id}"
+    params = {
+        'api_key': HIPSTAMP_API_KEY,
+        'id': listing_id,
+        'quantity': quantity
+    }
+    response = send_request("HipStamp", "PUT", url, params=params)
+    response.raise_for_status()
+
+def iter_hipstamp_search(product_title):
+    # Every active listing whose title contains product_title, fetched page by page as the caller
+    # works through them. Raises requests.RequestException if a page fails.
+    url = f"{HIPSTAMP_API_ENDPOINT}/stores/{HIPSTAMP_USERNAME}/listings/active"
+    return iter_records(iter_hipstamp_pages(url, None, {'api_key': HIPSTAMP_API_KEY, 'keywords': product_title}), 'results')
+
+def update_hipstamp_quantity(sale_lines, title_index=None, ledger=None):
+    # Order items are grouped by the listing they resolve to, so each listing gets one read of its
+    # current quantity and one write of the netted result however many orders sold it. Outcomes
+    # are still logged once per order item.
+    if title_index is None:
+        title_index = {}
+    if not title_index:
+        title_index.update(load_title_index(HIPSTAMP_INDEX_FILE))
+    index_lock = threading.Lock()
+    index_changed = False
+    lines_by_title = {}
+    for line in sale_lines:
+        lines_by_title.setdefault(line.title, []).append(line)
+    sold_by_listing = {}
+    current_quantities = {}
+    num_applied = 0
+
+    def record_each(sold, level, event_type, message_for):
+        for line in sold:
+            record_event(level, event_type, "HipStamp", line.title, message_for(line.title))
+            if ledger is not None and event_type in PERMANENT_FAILURES:
+                ledger.mark_failed("ChannelAdvisor", line.ledger_key, event_type)
+
+    # Step 1: Resolve each title to a listing, using the local index before the API
+    def resolve_title(product_title):
+        nonlocal index_changed
+        sold = lines_by_title[product_title]
+        entries = title_index.get(product_title)
+        if entries is not None and len(entries) > 1:
+            record_each(sold, logging.ERROR, eventlog.DUPLICATE, lambda title: f"Multiple matching products found in HipStamp for product {title}.")
+            return
+        elif entries:
+            listing_id = entries[0].id
+        else:
+            # Keyword search also finds longer titles containing this one, possibly more than a page of them
+            num_found = 0
+            results = []
             try:
-                response_check = requests.get(url_check, params=params_check)
-                response_check.raise_for_status()
-                response_data = response_check.json()
-                if response_data['count'] == 0:
-                    logging.error(f"No matching product found in HipStamp for product {product_title}.[DISPLAY]")
-                    logging.error(f"Full response: {response_data}")
-                    continue
-                elif response_data['count'] > 1:
-                    logging.error(f"Multiple matching products found in HipStamp for product {product_title}.[DISPLAY]")
-                    logging.error(f"Full response: {response_data}")
-                    continue
-                else:
-                    listing_id = response_data['results'][0]['id']
-                    current_quantity = response_data['results'][0]['quantity']
-                    updated_quantity = int(current_quantity) - new_quantity    
-                    logging.info(f"Successfully matched product in HipStamp: {product_title}.")
-                    if updated_quantity < 0:
-                        logging.error(f"Error: Updated quantity for {product_title} is negative. Skipping update.[DISPLAY]")
-                        continue
+                for result in iter_hipstamp_search(product_title):
+                    num_found += 1
+                    if num_found == 1 or result.get('name') == product_title:
+                        results.append(result)
             except requests.RequestException as e:
-                logging.error(f"Error checking product existence in HipStamp for product {product_title}: {e}[DISPLAY]")
-                continue
+                record_each(sold, logging.ERROR, eventlog.ERROR, lambda title: f"Error checking product existence in HipStamp for product {title}: {e}")
+                return
+            if num_found > 1:
+                results = [result for result in results if result.get('name') == product_title]
+            if num_found == 0:
+                record_each(sold, logging.ERROR, eventlog.NO_MATCH, lambda title: f"No matching product found in HipStamp for product {title}.")
+                return
+            elif len(results) != 1:
+                record_each(sold, logging.ERROR, eventlog.DUPLICATE, lambda title: f"Multiple matching products found in HipStamp for product {title}.")
+                return
+            listing_id = results[0]['id']
+            with index_lock:
+                title_index[product_title] = [records.InventoryItem(listing_id, product_title, results[0]['quantity'])]
+                index_changed = True
+                # Fresh from the API, so step 2 does not need to read it again
+                current_quantities[listing_id] = results[0]['quantity']
+        with index_lock:
+            sold_by_listing.setdefault(listing_id, []).extend(sold)
+
+    run_grouped(list(lines_by_title), lambda product_title: product_title, resolve_title)
+    check_cancelled()
 
-            # Step 2: Update the product quantity
-            url = f"{HIPSTAMP_API_ENDPOINT}/listings/{listing_id}"
-            params = {
-                'api_key': HIPSTAMP_API_KEY,
-                'id': listing_id,
-                'quantity': updated_quantity
-            }
+    num_items = sum(len(sold) for sold in sold_by_listing.values())
+    logging.info(f"Applying {num_items} ChannelAdvisor order items to {len(sold_by_listing)} HipStamp listings.")
+
+    # Step 2: Read each listing's live quantity once and write the netted quantity once. The
+    # indexed quantity is not used for this, as it misses HipStamp's own sales since the snapshot.
+    def update_listing(listing_id):
+        nonlocal num_applied, index_changed
+        sold = sold_by_listing[listing_id]
+        product_title = sold[0].title
+        current_quantity = current_quantities.get(listing_id)
+        if current_quantity is None:
+            # The search is paged through until the listing turns up, however many titles contain this one
             try:
-                response = requests.put(url, params=params)
-                response.raise_for_status()
-                logging.info(f"Updated HipStamp inventory for product {product_title}. Decremented by {new_quantity}.[DISPLAY]")
+                current_quantity = next((result['quantity'] for result in iter_hipstamp_search(product_title) if result['id'] == listing_id), None)
             except requests.RequestException as e:
-                logging.error(f"Failed to update HipStamp inventory for product {product_title}: {e}[DISPLAY]")
+                record_each(sold, logging.ERROR, eventlog.ERROR, lambda title: f"Error checking product existence in HipStamp for product {title}: {e}")
+                return
+            if current_quantity is None:
+                record_each(sold, logging.ERROR, eventlog.NO_MATCH, lambda title: f"No matching product found in HipStamp for product {title}.")
+                return
+
+        total_sold = sum(line.quantity for line in sold)
+        updated_quantity = int(current_quantity) - total_sold
+        logging.info(f"Successfully matched product in HipStamp: {product_title}.")
+        if updated_quantity < 0:
+            record_each(sold, logging.ERROR, eventlog.ERROR, lambda title: f"Error: Updated quantity for {title} is negative. Skipping update.")
+            return
+
+        try:
+            put_hipstamp_quantity(listing_id, updated_quantity)
+        except requests.RequestException as e:
+            record_each(sold, logging.ERROR, eventlog.ERROR, lambda title: f"Failed to update HipStamp inventory for product {title}: {e}")
+            return
+        if len(sold) > 1:
+            logging.info(f"Netted {len(sold)} order items into one update of HipStamp listing {listing_id}: {current_quantity} to {updated_quantity}.")
+        with index_lock:
+            for title in {line.title for line in sold}:
+                for entry in title_index.get(title, []):
+                    if entry.id == listing_id:
+                        entry.quantity = updated_quantity
+                        index_changed = True
+            num_applied += len(sold)
+        for line in sold:
+            if ledger is not None:
+                ledger.mark_applied("ChannelAdvisor", line.ledger_key)
+            record_event(logging.INFO, eventlog.DECREMENTED, "HipStamp", line.title, f"Updated HipStamp inventory for product {line.title}. Decremented by {line.quantity}.", line.quantity)
+
+    run_grouped(list(sold_by_listing), lambda listing_id: listing_id, update_listing)
+
+    if index_changed:
+        save_title_index(HIPSTAMP_INDEX_FILE, title_index)
+    return num_applied
+
+token_lock = threading.Lock()
+token_cache = {"access_token": None, "expires_at": 0, "previous_token": None, "loaded": False}
+
+def reset_state():
+    # Rebuilds everything that depends on the loaded config
+    global event_log
+    rate_limiters["HipStamp"] = TokenBucket(HIPSTAMP_REQUESTS_PER_SECOND)
+    rate_limiters["ChannelAdvisor"] = TokenBucket(CHANNEL_ADVISOR_REQUESTS_PER_SECOND)
+    for platform in list(sessions):
+        sessions[platform].close()
+        sessions[platform] = create_session()
+    with token_lock:
+        token_cache.update(access_token=None, expires_at=0, previous_token=None, loaded=False)
+    metrics.reset()
+    with event_log_lock:
+        if event_log is not None:
+            event_log.close()
+        event_log = None
+
+def load_cached_token():
+    token_cache["loaded"] = True
+    if not TOKEN_CACHE_FILE:
+        return
+    try:
+        with open(TOKEN_CACHE_FILE, 'r') as f:
+            cached = json.load(f)
+        token_cache["access_token"] = cached["access_token"]
+        token_cache["expires_at"] = cached["expires_at"]
+        logging.info(f"Loaded cached ChannelAdvisor access token from {TOKEN_CACHE_FILE}.")
+    except FileNotFoundError:
+        pass
+    except (json.JSONDecodeError, KeyError) as e:
+        logging.warning(f"Ignoring unreadable token cache {TOKEN_CACHE_FILE}: {e}")
 
-def get_access_token():
-    url = "https://api.channeladvisor.com/oauth2/token"
+def save_cached_token():
+    if not TOKEN_CACHE_FILE:
+        return
+    temp_file = f"{TOKEN_CACHE_FILE}.tmp"
+    # The token grants API access, so only the owner may read it. A leftover temp file could have
+    # looser permissions, and os.open only applies the mode when it creates the file.
+    try:
+        os.remove(temp_file)
+    except FileNotFoundError:
+        pass
+    with os.fdopen(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as f:
+        json.dump({"access_token": token_cache["access_token"], "expires_at": token_cache["expires_at"]}, f)
+    os.replace(temp_file, TOKEN_CACHE_FILE)
+
+def get_access_token(stale_token=None):
+    # The cached token is reused until TOKEN_REFRESH_MARGIN_SECONDS before it expires. The lock
+    # means callers arriving during a refresh wait for it and share its result. stale_token is
+    # the token a request was just rejected with; it is only refreshed if nobody has already.
+    ensure_config()
+    with token_lock:
+        if not token_cache["loaded"]:
+            load_cached_token()
+        cached = token_cache["access_token"]
+        if cached is not None and cached != stale_token and time.time() < token_cache["expires_at"] - TOKEN_REFRESH_MARGIN_SECONDS:
+            return cached
+        return request_access_token()
+
+def request_access_token():
+    url = CHANNEL_ADVISOR_TOKEN_URL
     data = {
         "grant_type": "refresh_token",
         "refresh_token": CHANNEL_ADVISOR_REFRESH_TOKEN,
         "client_id": CHANNEL_ADVISOR_CLIENT_ID,
         "client_secret": CHANNEL_ADVISOR_CLIENT_SECRET
     }
+    response = None
     try:
-        response = requests.post(url, data=data)
+        response = send_request("ChannelAdvisor", "POST", url, data=data)
         response.raise_for_status()
         json_response = response.json()
         if 'access_token' in json_response:
+            token_cache["previous_token"] = token_cache["access_token"]
+            token_cache["access_token"] = json_response["access_token"]
+            token_cache["expires_at"] = time.time() + int(json_response.get("expires_in", 3600))
+            save_cached_token()
+            logging.info(f"Refreshed ChannelAdvisor access token, valid for {json_response.get('expires_in', 3600)} seconds.")
             return json_response["access_token"]
         else:
             logging.error("Missing access_token in API response.")
@@ -260,7 +979,8 @@ def get_access_token():
 
     except requests.RequestException as e:
         logging.error(f"Failed to get ChannelAdvisor access token: {e}")
-        logging.error(f"Response content: {response.content}")
+        if response is not None:
+            logging.error(f"Response content: {response.content}")
         return None
 
 def validate_response(response_json, expected_keys, source_name):
@@ -270,39 +990,356 @@ def validate_response(response_json, expected_keys, source_name):
             return False
     return True
 
-def main():
-    access_token = get_access_token()
-    if access_token is None:
-        logging.error("Terminating script due to unsuccessful token retrieval.")
-        exit(1)
+def sync_once(access_token, hipstamp_index, channeladvisor_index):
+    ensure_config()
+    pruned = get_event_log().prune(EVENT_RETENTION_DAYS)
+    if pruned:
+        logging.info(f"Removed {pruned} sync events older than {EVENT_RETENTION_DAYS} days.")
+    with saleledger.SaleLedger(SALE_LEDGER_FILE) as ledger:
+        with metrics.phase("hipstamp_sales"):
+            num_processed = sync_hipstamp_sales(access_token, channeladvisor_index, ledger)
+        with metrics.phase("channeladvisor_sales"):
+            num_processed += sync_channeladvisor_sales(access_token, hipstamp_index, ledger)
+        return num_processed
 
-    log_current_hipstamp_inventory()
-    log_current_channeladvisor_inventory(access_token)
+def unsettled_lines(platform, sale_lines, ledger):
+    # Lines neither applied nor set aside after a failure
+    return [line for line in sale_lines
+            if not ledger.is_applied(platform, line.ledger_key) and not ledger.has_failed(platform, line.ledger_key)]
 
+def settled_watermark(platform, newest, sale_lines, created_by_key, ledger):
+    # The watermark stops at the oldest line still unsettled after applying, so the next sweep fetches it again
+    for line in unsettled_lines(platform, sale_lines, ledger):
+        created = created_by_key.get(line.ledger_key)
+        try:
+            if created and to_utc(created) < to_utc(newest):
+                newest = created
+        except ValueError:
+            pass
+    return newest
+
+def sync_hipstamp_sales(access_token, channeladvisor_index, ledger):
     # HipStamp to ChannelAdvisor sync
-    last_checked_time_hip = get_last_checked_time(LAST_CHECKED_FILE_HIP)
-    sales_data_hip = fetch_hipstamp_sales(last_checked_time_hip)
-    if sales_data_hip is not None and validate_response(sales_data_hip, ['results'], 'HipStamp'):
-        num_sales = len(sales_data_hip.get('results', []))
-        logging.info(f"{num_sales} new sales fetched from HipStamp since {last_checked_time_hip}") 
-        for sale in sales_data_hip.get('results', []):
-            if 'SaleListings' in sale:
-                update_channeladvisor_quantity(sale.get('SaleListings', []), access_token)
-        update_last_checked_time(LAST_CHECKED_FILE_HIP)
-    else:
+    watermark = get_sync_start_time("HipStamp", ledger)
+    sales_pages_hip = fetch_hipstamp_sales(fetch_window_start(watermark))
+    if sales_pages_hip is None:
         logging.warning("Failed to fetch HipStamp sales data.")
-    
+        return 0
+    try:
+        # Listings from every page are collected first so repeat sales of a product net into one update
+        num_sales = 0
+        num_already_applied = 0
+        num_failed = 0
+        newest = watermark
+        sale_lines = []
+        created_by_key = {}
+        for sales in sales_pages_hip:
+            num_sales += len(sales)
+            newest = newest_created_time(sales, newest)
+            for sale in sales:
+                for line in sale.lines:
+                    if ledger.is_applied("HipStamp", line.ledger_key):
+                        num_already_applied += 1
+                    elif ledger.has_failed("HipStamp", line.ledger_key):
+                        num_failed += 1
+                    else:
+                        sale_lines.append(line)
+                        created_by_key[line.ledger_key] = sale.created
+    except requests.RequestException as e:
+        logging.error(f"Error fetching HipStamp sales: {e}")
+        logging.warning("Failed to fetch HipStamp sales data.")
+        return 0
+    logging.info(f"{num_sales} new sales fetched from HipStamp since {watermark}, {num_already_applied} sale listings already applied, "
+                 f"{num_failed} set aside after an earlier failure.")
+    with apply_lock:
+        # Checked again, as the webhook receiver may have applied some while the pages were fetched
+        num_applied = update_channeladvisor_quantity(unsettled_lines("HipStamp", sale_lines, ledger), access_token, channeladvisor_index, ledger)
+    check_cancelled()
+    newest = settled_watermark("HipStamp", newest, sale_lines, created_by_key, ledger)
+    if newest != watermark:
+        ledger.set_watermark("HipStamp", newest)
+    return num_applied
+
+def sync_channeladvisor_sales(access_token, hipstamp_index, ledger):
     # ChannelAdvisor to HipStamp sync
-    last_checked_time_ca = get_last_checked_time(LAST_CHECKED_FILE_CA)
-    sales_data_ca = fetch_channeladvisor_sales(last_checked_time_ca, access_token)
-    if sales_data_ca is not None and validate_response(sales_data_ca, ['value'], 'ChannelAdvisor'):
-        list_of_sales = sales_data_ca.get('value', [])
-        num_sales = len(list_of_sales)
-        logging.info(f"{num_sales} new sales fetched from ChannelAdvisor since {last_checked_time_ca}")
-        update_hipstamp_quantity(list_of_sales)
-        update_last_checked_time(LAST_CHECKED_FILE_CA)
-    else:
+    watermark = get_sync_start_time("ChannelAdvisor", ledger)
+    sales_pages_ca = fetch_channeladvisor_sales(fetch_window_start(watermark), access_token)
+    if sales_pages_ca is None:
         logging.warning("Failed to fetch ChannelAdvisor sales data.")
+        return 0
+    try:
+        # Items from every page are collected first so repeat sales of a listing net into one update
+        num_sales = 0
+        num_already_applied = 0
+        num_failed = 0
+        newest = watermark
+        sale_lines = []
+        created_by_key = {}
+        for list_of_sales in sales_pages_ca:
+            num_sales += len(list_of_sales)
+            newest = newest_created_time(list_of_sales, newest)
+            for sale in list_of_sales:
+                for line in sale.lines:
+                    if ledger.is_applied("ChannelAdvisor", line.ledger_key):
+                        num_already_applied += 1
+                    elif ledger.has_failed("ChannelAdvisor", line.ledger_key):
+                        num_failed += 1
+                    else:
+                        sale_lines.append(line)
+                        created_by_key[line.ledger_key] = sale.created
+    except requests.RequestException as e:
+        logging.error(f"Error fetching ChannelAdvisor sales: {e}")
+        logging.warning("Failed to fetch ChannelAdvisor sales data.")
+        return 0
+    logging.info(f"{num_sales} new sales fetched from ChannelAdvisor since {watermark}, {num_already_applied} order items already applied, "
+                 f"{num_failed} set aside after an earlier failure.")
+    with apply_lock:
+        num_applied = update_hipstamp_quantity(unsettled_lines("ChannelAdvisor", sale_lines, ledger), hipstamp_index, ledger)
+    check_cancelled()
+    newest = settled_watermark("ChannelAdvisor", newest, sale_lines, created_by_key, ledger)
+    if newest != watermark:
+        ledger.set_watermark("ChannelAdvisor", newest)
+    return num_applied
+
+def collect_pending_sales(access_token, ledger):
+    # Sale lines in each platform's sync window that have not been applied to the other platform yet,
+    # as ({title: [(ledger_key, quantity)]} for HipStamp, the same for ChannelAdvisor)
+    pending_hipstamp, pending_channeladvisor = {}, {}
+    sales_pages_hip = fetch_hipstamp_sales(fetch_window_start(get_sync_start_time("HipStamp", ledger)))
+    sales_pages_ca = fetch_channeladvisor_sales(fetch_window_start(get_sync_start_time("ChannelAdvisor", ledger)), access_token)
+    if sales_pages_hip is None or sales_pages_ca is None:
+        raise SyncError("Could not fetch pending sales. See sync_log.log for details.")
+
+    try:
+        for platform, pages, pending in (("HipStamp", sales_pages_hip, pending_hipstamp),
+                                         ("ChannelAdvisor", sales_pages_ca, pending_channeladvisor)):
+            for sales in pages:
+                for sale in sales:
+                    for line in sale.lines:
+                        if not ledger.is_applied(platform, line.ledger_key):
+                            pending.setdefault(line.title, []).append((line.ledger_key, line.quantity))
+    except requests.RequestException as e:
+        raise SyncError(f"Could not fetch pending sales: {e}")
+    return pending_hipstamp, pending_channeladvisor
+
+def apply_reconciliation(changes, access_token, source, ledger):
+    # Pushes the absolute quantities from reconcile.plan_reconciliation: ChannelAdvisor in $batch
+    # requests, HipStamp one PUT per listing. Once every update a product needed has gone through, its
+    # pending sale lines are marked applied, since the new quantities already account for them.
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    def succeeded(change, platform, title, old_quantity):
+        change['updated'].append(platform)
+        record_event(logging.INFO, eventlog.RECONCILED, platform, title,
+                     f"Set {platform} quantity for product {title} to {change['target']} (was {old_quantity}) from {source}.", change['target'])
+
+    def failed(change, platform, title, reason):
+        change['status'] = "failed"
+        record_event(logging.ERROR, eventlog.ERROR, platform, title, f"Failed to set {platform} quantity for product {title}: {reason}")
+
+    def send_batch(batch):
+        try:
+            statuses = post_channeladvisor_updates([(change['ca_id'], quantity_payload("Absolute", change['target'])) for change in batch], headers)
+        except requests.RequestException as e:
+            for change in batch:
+                failed(change, "ChannelAdvisor", change['ca_title'], e)
+            return
+        for change in batch:
+            status = statuses.get(change['ca_id'])
+            if status is not None and 200 <= status < 300:
+                succeeded(change, "ChannelAdvisor", change['ca_title'], change['ca_quantity'])
+            else:
+                failed(change, "ChannelAdvisor", change['ca_title'], f"batch item returned status {status}")
+
+    def set_listing(change):
+        try:
+            put_hipstamp_quantity(change['hip_id'], change['target'])
+            succeeded(change, "HipStamp", change['hip_title'], change['hip_quantity'])
+        except requests.RequestException as e:
+            failed(change, "HipStamp", change['hip_title'], e)
+
+    for change in changes:
+        change['updated'] = []
+    channeladvisor_changes = [change for change in changes if change['set_channeladvisor']]
+    batches = [channeladvisor_changes[i:i + CHANNEL_ADVISOR_BATCH_SIZE] for i in range(0, len(channeladvisor_changes), CHANNEL_ADVISOR_BATCH_SIZE)]
+    hipstamp_changes = [change for change in changes if change['set_hipstamp']]
+    logging.info(f"Reconciling {len(changes)} products from {source}: {len(hipstamp_changes)} HipStamp listings, "
+                 f"{len(channeladvisor_changes)} ChannelAdvisor products in {len(batches)} batch requests.")
+    run_grouped(batches, lambda batch: batch[0]['ca_id'], send_batch)
+    run_grouped(hipstamp_changes, lambda change: change['hip_id'], set_listing)
+
+    for change in changes:
+        # A cancelled run leaves the changes it never reached as planned
+        if change['status'] != "planned" or len(change['updated']) < change['set_hipstamp'] + change['set_channeladvisor']:
+            continue
+        change['status'] = "updated"
+        for key, _ in change['pending_hipstamp']:
+            ledger.mark_applied("HipStamp", key)
+        for key, _ in change['pending_channeladvisor']:
+            ledger.mark_applied("ChannelAdvisor", key)
+    check_cancelled()
+    return changes
+
+class SyncEngine:
+    # Loads the config once and keeps the title indexes between calls, so a caller (the GUI, the
+    # CLI, the daemon loop) can construct one and call sync() as often as it likes.
+    def __init__(self, config_file='config.json', metrics_file=None):
+        load_config(config_file)
+        self.metrics_file = metrics_file
+        self.hipstamp_index = None
+        self.channeladvisor_index = None
+        self.inventory_time = None
+
+    def access_token(self):
+        with metrics.phase("access_token"):
+            access_token = get_access_token()
+        if access_token is None:
+            raise SyncError("Could not get a ChannelAdvisor access token. See sync_log.log for details.")
+        return access_token
+
+    def snapshot(self, full=False):
+        # full=True skips the incremental ChannelAdvisor fetch, which misses products whose quantity
+        # changed without touching UpdateDateUtc
+        access_token = self.access_token()
+        with metrics.phase("hipstamp_snapshot"):
+            self.hipstamp_index = log_current_hipstamp_inventory()
+        with metrics.phase("channeladvisor_snapshot"):
+            self.channeladvisor_index = log_current_channeladvisor_inventory(access_token, full)
+        self.inventory_time = time.monotonic()
+        write_metrics(self.metrics_file)
+
+    def sync(self, refresh_inventory=None):
+        # With refresh_inventory=None the inventory is only downloaded again once it is
+        # DAEMON_INVENTORY_REFRESH_SECONDS old. With False it is not downloaded, and titles are looked up
+        # in the indexes saved by the last snapshot. Returns the number of sale lines applied.
+        try:
+            with metrics.phase("sync"):
+                access_token = self.access_token()
+                if refresh_inventory is None:
+                    refresh_inventory = self.inventory_time is None or time.monotonic() - self.inventory_time >= DAEMON_INVENTORY_REFRESH_SECONDS
+                if refresh_inventory:
+                    self.snapshot()
+                else:
+                    if self.hipstamp_index is None:
+                        self.hipstamp_index = load_title_index(HIPSTAMP_INDEX_FILE)
+                    if self.channeladvisor_index is None:
+                        self.channeladvisor_index = load_title_index(CHANNEL_ADVISOR_INDEX_FILE)
+                return sync_once(access_token, self.hipstamp_index, self.channeladvisor_index)
+        finally:
+            write_metrics(self.metrics_file)
+
+    def apply_sale_lines(self, lines_by_platform, ledger):
+        # Applies {platform: [records.SaleLine]} pushed to the webhook receiver without fetching any
+        # sales. Returns the number of lines applied.
+        try:
+            with apply_lock, metrics.phase("webhook"):
+                hipstamp_lines = unsettled_lines("HipStamp", lines_by_platform.get("HipStamp", []), ledger)
+                channeladvisor_lines = unsettled_lines("ChannelAdvisor", lines_by_platform.get("ChannelAdvisor", []), ledger)
+                num_applied = 0
+                if hipstamp_lines:
+                    if self.channeladvisor_index is None:
+                        self.channeladvisor_index = load_title_index(CHANNEL_ADVISOR_INDEX_FILE)
+                    num_applied += update_channeladvisor_quantity(hipstamp_lines, self.access_token(), self.channeladvisor_index, ledger)
+                if channeladvisor_lines:
+                    if self.hipstamp_index is None:
+                        self.hipstamp_index = load_title_index(HIPSTAMP_INDEX_FILE)
+                    num_applied += update_hipstamp_quantity(channeladvisor_lines, self.hipstamp_index, ledger)
+                return num_applied
+        finally:
+            write_metrics(self.metrics_file)
+
+    def compare(self, refresh=True, fuzzy_threshold=None, fuzzy=True):
+        import reconcile
+        if refresh:
+            self.snapshot()
+        if fuzzy_threshold is None:
+            fuzzy_threshold = reconcile.DEFAULT_FUZZY_THRESHOLD
+        with metrics.phase("compare"):
+            result = reconcile.compare_inventories(load_inventory_snapshot("HipStamp"), load_inventory_snapshot("ChannelAdvisor"),
+                                                   fuzzy_threshold if fuzzy else None)
+        write_metrics(self.metrics_file)
+        return result
+
+    def reconcile(self, source, apply=True, include_fuzzy=False, fuzzy_threshold=None):
+        # Sets both platforms to the source of truth's quantity for every matched product whose
+        # quantities differ or that has pending sales. Pending sales are read before the inventory, so a sale landing in between
+        # is counted twice (leaving the quantity too low) rather than missed. Returns the list of changes.
+        import reconcile
+        if source not in ("HipStamp", "ChannelAdvisor"):
+            raise ValueError(f"Unknown source of truth {source}")
+        try:
+            with metrics.phase("reconcile"):
+                access_token = self.access_token()
+                with saleledger.SaleLedger(SALE_LEDGER_FILE) as ledger:
+                    pending_hipstamp, pending_channeladvisor = collect_pending_sales(access_token, ledger)
+                    # Absolute quantities are about to be written, so nothing may come from an older snapshot
+                    self.snapshot(full=True)
+                    if fuzzy_threshold is None:
+                        fuzzy_threshold = reconcile.DEFAULT_FUZZY_THRESHOLD
+                    # Every match is planned over, as one whose quantities agree can still have pending sales
+                    result = reconcile.compare_inventories(load_inventory_snapshot("HipStamp"), load_inventory_snapshot("ChannelAdvisor"),
+                                                           fuzzy_threshold if include_fuzzy else None, all_matches=True)
+                    changes = reconcile.plan_reconciliation(result, source, pending_hipstamp, pending_channeladvisor, include_fuzzy)
+                    if apply:
+                        apply_reconciliation(changes, access_token, source, ledger)
+                return changes
+        finally:
+            write_metrics(self.metrics_file)
+
+    def run_daemon(self, stop_event=None, webhook_port=None):
+        # Keeps the HTTP sessions, cached access token and title indexes between cycles. Polling speeds
+        # back up to DAEMON_POLL_SECONDS as soon as a cycle finds sales and slows down while none arrive.
+        # With a webhook port (or WEBHOOK_PORT) sales pushed to it are applied as they arrive, and the
+        # polling becomes a catch-up sweep for anything the webhooks missed.
+        if stop_event is None:
+            stop_event = threading.Event()
+
+            def request_stop(signum, frame):
+                logging.info(f"Received signal {signum}. Stopping after the current sync cycle.")
+                stop_event.set()
+
+            signal.signal(signal.SIGINT, request_stop)
+            signal.signal(signal.SIGTERM, request_stop)
+
+        if webhook_port is None:
+            webhook_port = WEBHOOK_PORT
+        receiver = None
+        if webhook_port is not None:
+            import webhook
+            receiver = webhook.WebhookServer(self, WEBHOOK_HOST, webhook_port, WEBHOOK_SECRET).start()
+
+        poll_seconds = DAEMON_POLL_SECONDS
+        logging.info(f"Starting continuous sync, polling every {DAEMON_POLL_SECONDS} to {DAEMON_MAX_POLL_SECONDS} seconds.")
+        try:
+            while not stop_event.is_set():
+                num_processed = 0
+                try:
+                    num_processed = self.sync()
+                except SyncError as e:
+                    logging.error(f"Skipping sync cycle: {e}")
+                except Exception as e:
+                    logging.error(f"Unexpected error during sync cycle: {e}")
+
+                if num_processed:
+                    poll_seconds = DAEMON_POLL_SECONDS
+                else:
+                    poll_seconds = min(poll_seconds * 2, DAEMON_MAX_POLL_SECONDS)
+                stop_event.wait(poll_seconds)
+        finally:
+            if receiver is not None:
+                receiver.stop()
+        logging.info("Continuous sync stopped.")
+
+def main():
+    try:
+        SyncEngine().sync(refresh_inventory=True)
+    except (ConfigError, SyncError) as e:
+        logging.error(f"Terminating script: {e}")
+        exit(1)
+
+def run_daemon(stop_event=None, webhook_port=None):
+    SyncEngine().run_daemon(stop_event, webhook_port)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import cli
+    sys.exit(cli.main(["daemon"] if "--daemon" in sys.argv[1:] else ["sync", "--refresh-inventory"]))
\ No newline at end of file
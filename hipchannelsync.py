@@ -1,84 +1,196 @@
 import tkinter as tk
-from tkinter import messagebox, scrolledtext, ttk
+from tkinter import messagebox, ttk
 import datetime
-import os
+import queue
+import threading
+import time
 import hipchannel
-import json
-
-root = tk.Tk()
-root.title("HipStamp / ChannelAdvisor Synchronizer")
-title_label = tk.Label(root, text="Welcome to the HipStamp / ChannelAdvisor Inventory Sync App!", font=("Helvetica", 16))
-title_label.pack(pady=(10, 0))
-
-def load_hipstamp_inventory():
-    with open('hipstamp_inventory_backup.json', 'r') as f:
-        return json.load(f)
-
-def load_channeladvisor_inventory():
-    with open('channeladvisor_inventory_backup.json', 'r') as f:
-        return json.load(f)
-
-def compare_inventories(hip_inventory, ca_inventory):
-    comparison_data = []
-    ca_inventory_items = ca_inventory.get('value', [])
-    ca_inventory_dict = {item['Title']: item for item in ca_inventory_items}
-    hip_inventory_items = hip_inventory.get('results', [])
-    hip_inventory_dict = {item['name']: item for item in hip_inventory_items}
-    for hip_item in hip_inventory_items:
-        hip_title = hip_item['name']
-        hip_quantity = hip_item['quantity']
-        ca_item = ca_inventory_dict.get(hip_title)
-        if ca_item:
-            ca_quantity = ca_item['TotalAvailableQuantity']
-            if hip_quantity != ca_quantity:
-                comparison_data.append({
-                    "HipStamp Title": hip_title,
-                    "HipStamp Quantity": hip_quantity,
-                    "ChannelAdvisor Title": ca_item['Title'],
-                    "ChannelAdvisor Quantity": ca_quantity
-                })
-            del ca_inventory_dict[hip_title]
+import eventlog
+
+# Widgets and the sync engine shared by the functions below; set up by main()
+root = None
+engine = None
+run_button = None
+compare_button = None
+cancel_button = None
+status_label = None
+
+class VirtualTable:
+    # A Treeview that only ever holds the rows currently on screen. The source supplies
+    # len(source) and source.rows(start, count); scrolling re-renders from the source.
+    def __init__(self, parent, columns, source, column_widths=None):
+        self.source = source
+        self.offset = 0
+        self.visible_rows = 25
+        self.selected = set()
+        self.frame = ttk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, columns=columns, show='headings', height=self.visible_rows, selectmode='extended')
+        for col in columns:
+            self.tree.heading(col, text=col)
+            if column_widths and col in column_widths:
+                self.tree.column(col, width=column_widths[col], stretch=False)
+        self.scrollbar = tk.Scrollbar(self.frame, orient="vertical", command=self.on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        h_scrollbar = tk.Scrollbar(self.frame, orient="horizontal", command=self.tree.xview)
+        h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.tree.configure(xscrollcommand=h_scrollbar.set)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.tree.bind("<MouseWheel>", lambda event: self.scroll_to(self.offset - 3 * (1 if event.delta > 0 else -1)))
+        self.tree.bind("<Button-4>", lambda event: self.scroll_to(self.offset - 3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_to(self.offset + 3))
+        self.tree.bind("<Prior>", lambda event: self.scroll_to(self.offset - self.visible_rows))
+        self.tree.bind("<Next>", lambda event: self.scroll_to(self.offset + self.visible_rows))
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+
+    def on_resize(self, event):
+        row_height = ttk.Style().lookup("Treeview", "rowheight") or 20
+        visible_rows = max(1, event.height // int(row_height) - 1)
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            self.refresh()
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * len(self.source)))
+        elif unit == "pages":
+            self.scroll_to(self.offset + int(amount) * self.visible_rows)
+        else:
+            self.scroll_to(self.offset + int(amount))
+
+    def scroll_to(self, offset):
+        offset = max(0, min(offset, len(self.source) - self.visible_rows))
+        if offset != self.offset:
+            self.offset = offset
+            self.refresh()
+        return "break"
+
+    def on_select(self, event):
+        # Selection is kept as source positions so it survives scrolling out of view
+        visible = {int(iid) for iid in self.tree.get_children()}
+        self.selected = (self.selected - visible) | {int(iid) for iid in self.tree.selection()}
+
+    def selected_positions(self):
+        return sorted(self.selected)
+
+    def refresh(self, reset=False):
+        if reset:
+            self.offset = 0
+            self.selected = set()
+        total = len(self.source)
+        self.offset = max(0, min(self.offset, total - self.visible_rows))
+        self.tree.delete(*self.tree.get_children())
+        for position, row in enumerate(self.source.rows(self.offset, self.visible_rows), start=self.offset):
+            self.tree.insert("", tk.END, iid=str(position), values=row)
+        visible_selection = [str(position) for position in self.selected if self.offset <= position < self.offset + self.visible_rows]
+        if visible_selection:
+            self.tree.selection_set(visible_selection)
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.visible_rows) / total))
         else:
-            comparison_data.append({
-                "HipStamp Title": hip_title,
-                "HipStamp Quantity": hip_quantity,
-                "ChannelAdvisor Title": "N/A",
-                "ChannelAdvisor Quantity": "N/A"
-            })
-    for ca_title, ca_item in ca_inventory_dict.items():
-        comparison_data.append({
-            "HipStamp Title": "N/A",
-            "HipStamp Quantity": "N/A",
-            "ChannelAdvisor Title": ca_title,
-            "ChannelAdvisor Quantity": ca_item['TotalAvailableQuantity']
-        })
-    return comparison_data
+            self.scrollbar.set(0, 1)
+
+class ComparisonSource:
+    # Sorting and filtering reorder a list of row positions in the ComparisonResult, never the widget
+    def __init__(self, result):
+        self.result = result
+        self.order = list(range(len(result)))
+        self.sort_column = None
+        self.sort_reverse = False
+        self.filter_text = ""
+
+    def __len__(self):
+        return len(self.order)
+
+    def rows(self, start, count):
+        return [self.result.row(i) for i in self.order[start:start + count]]
+
+    def set_filter(self, text):
+        self.filter_text = text.casefold().strip()
+        self.apply()
+
+    def sort_by(self, column):
+        self.sort_reverse = not self.sort_reverse if self.sort_column == column else False
+        self.sort_column = column
+        self.apply()
+
+    def apply(self):
+        positions = range(len(self.result))
+        if self.filter_text:
+            titles = (self.result.hip_titles, self.result.ca_titles)
+            positions = [i for i in positions if any(self.filter_text in (column[i] or "").casefold() for column in titles)]
+        self.order = list(positions)
+        if self.sort_column is not None:
+            self.order.sort(key=self.result.sort_key(self.sort_column), reverse=self.sort_reverse)
+
+class EventSource:
+    # Rows come straight from the event log a window at a time; the window just read is kept
+    def __init__(self, event_types, window=200):
+        self.event_types = event_types
+        self.search = None
+        self.window = window
+        self.cache_start = None
+        self.cache = []
+        self.total = hipchannel.get_event_log().count(event_types)
+
+    def __len__(self):
+        return self.total
+
+    def set_filter(self, text):
+        self.search = text.strip() or None
+        self.reload()
+
+    def reload(self):
+        self.cache_start = None
+        self.total = hipchannel.get_event_log().count(self.event_types, search=self.search)
+
+    def events(self, start, count):
+        if self.cache_start is None or start < self.cache_start or start + count > self.cache_start + len(self.cache):
+            self.cache_start = max(0, start - self.window // 4)
+            self.cache = hipchannel.get_event_log().page(self.event_types, search=self.search, offset=self.cache_start,
+                                                         limit=max(self.window, count + self.window // 4))
+        return self.cache[start - self.cache_start:start - self.cache_start + count]
+
+    def rows(self, start, count):
+        return [(format_event(event),) for event in self.events(start, count)]
+
+    def delete(self, positions):
+        event_ids = [event[0] for position in positions for event in self.events(position, 1)]
+        hipchannel.get_event_log().delete(event_ids)
+        self.reload()
+
+def create_filter_entry(parent, source, table, on_apply=None):
+    filter_frame = ttk.Frame(parent)
+    tk.Label(filter_frame, text="Filter:").pack(side=tk.LEFT)
+    filter_var = tk.StringVar()
+    filter_entry = ttk.Entry(filter_frame, textvariable=filter_var)
+    filter_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+    def apply_filter(event=None):
+        source.set_filter(filter_var.get())
+        table.refresh(reset=True)
+        if on_apply is not None:
+            on_apply()
+    filter_entry.bind("<Return>", apply_filter)
+    ttk.Button(filter_frame, text="Apply", command=apply_filter).pack(side=tk.LEFT)
+    filter_frame.pack(side=tk.TOP, fill=tk.X, padx=10, pady=5)
 
 def compare_quantities():
-    hipchannel.log_current_hipstamp_inventory()
-    access_token = hipchannel.get_access_token()
-    hipchannel.log_current_channeladvisor_inventory(access_token)
-    hip_inventory = load_hipstamp_inventory()
-    ca_inventory = load_channeladvisor_inventory()
-    comparison_data = compare_inventories(hip_inventory, ca_inventory)
+    start_worker(engine.compare, "Comparing", show_comparison)
+
+def show_comparison(comparison_data):
+    status_label.config(text=f"Comparison finished at {datetime.datetime.now().strftime('%H:%M:%S')}: {len(comparison_data)} products need attention.")
     compare_window = tk.Toplevel(root)
     compare_window.title("Compare Inventories")
-    columns = ("HipStamp Title", "HipStamp Quantity", "ChannelAdvisor Title", "ChannelAdvisor Quantity")
-    inventory_table = ttk.Treeview(compare_window, columns=columns, show='headings')
-    for col in columns:
-        inventory_table.heading(col, text=col)
-    for item in comparison_data:
-        inventory_table.insert("", tk.END, values=(
-            item.get("HipStamp Title", "N/A"),
-            item.get("HipStamp Quantity", "N/A"),
-            item.get("ChannelAdvisor Title", "N/A"),
-            item.get("ChannelAdvisor Quantity", "N/A")
-        ))
-    inventory_table.pack(expand=tk.YES, fill=tk.BOTH)
-    scrollbar = tk.Scrollbar(compare_window, orient="vertical", command=inventory_table.yview)
-    inventory_table.configure(yscrollcommand=scrollbar.set)
-    scrollbar.pack(side="right", fill="y")
-    inventory_table.pack(side="left", expand=tk.YES, fill=tk.BOTH)
+    source = ComparisonSource(comparison_data)
+    inventory_table = VirtualTable(compare_window, comparison_data.columns, source)
+    for column_index, col in enumerate(comparison_data.columns):
+        def sort_by(column_index=column_index):
+            source.sort_by(column_index)
+            inventory_table.refresh(reset=True)
+        inventory_table.tree.heading(col, command=sort_by)
+    create_filter_entry(compare_window, source, inventory_table)
+    inventory_table.frame.pack(expand=tk.YES, fill=tk.BOTH)
+    inventory_table.refresh()
 
 def settings():
     settings_window = tk.Toplevel(root)
@@ -87,69 +199,138 @@ def settings():
     hipstamp_label.pack()
     hipstamp_text = tk.Text(settings_window, height=1, width=20)
     hipstamp_text.pack()
-    with open('lastcheckedhip.txt', 'r') as file:
-        hipstamp_text.insert(tk.END, file.read())
+    hipstamp_text.insert(tk.END, hipchannel.get_sync_start_time("HipStamp"))
     channeladvisor_label = tk.Label(settings_window, text="Check for new ChannelAdvisor sales since:")
     channeladvisor_label.pack()
     channeladvisor_text = tk.Text(settings_window, height=1, width=20)
     channeladvisor_text.pack()
-    with open('lastcheckedchannel.txt', 'r') as file:
-        channeladvisor_text.insert(tk.END, file.read())
-    instructions_label = tk.Label(settings_window, text="By default, the times given above are when the most recent sync occurred. Changing them will affect the next sync.")
+    channeladvisor_text.insert(tk.END, hipchannel.get_sync_start_time("ChannelAdvisor"))
+    instructions_label = tk.Label(settings_window, text="By default, the times given above are when the newest sale seen by a sync was made. Changing them will affect the next sync. Sales that were already synced are never applied twice.")
     instructions_label.pack()
     def save_settings():
-        with open('lastcheckedhip.txt', 'w') as file:
-            file.write(hipstamp_text.get("1.0", tk.END).strip())
-        with open('lastcheckedchannel.txt', 'w') as file:
-            file.write(channeladvisor_text.get("1.0", tk.END).strip())
+        try:
+            hipchannel.set_sync_start_time("HipStamp", hipstamp_text.get("1.0", tk.END).strip())
+            hipchannel.set_sync_start_time("ChannelAdvisor", channeladvisor_text.get("1.0", tk.END).strip())
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid date and time: {e}")
+            return
         settings_window.destroy()
     save_button = tk.Button(settings_window, text="Save", command=save_settings)
     save_button.pack()
 
+# Sync and compare run on a background thread. Progress from hipchannel is passed to the Tk main
+# thread through progress_queue, which poll_progress drains; widgets are only touched from there.
+progress_queue = queue.Queue()
+worker = None
+progress = {}
+
+def start_worker(target, description, on_done):
+    global worker
+    if worker is not None and worker.is_alive():
+        messagebox.showinfo("Busy", "A sync or comparison is already running.")
+        return
+    hipchannel.cancel_event.clear()
+    progress.clear()
+    progress.update(description=description, started=time.monotonic(), pages=0, updates=0,
+                    **{event_type: 0 for event_type in (eventlog.DECREMENTED, eventlog.NO_MATCH, eventlog.DUPLICATE, eventlog.ERROR)})
+
+    def listener(kind, details):
+        progress_queue.put(("progress", kind, details))
+
+    def run():
+        hipchannel.add_progress_listener(listener)
+        try:
+            progress_queue.put(("done", on_done, target()))
+        except hipchannel.SyncCancelled:
+            progress_queue.put(("cancelled", None, None))
+        except Exception as e:
+            progress_queue.put(("error", None, str(e)))
+        finally:
+            hipchannel.remove_progress_listener(listener)
+
+    set_busy(True)
+    status_label.config(text=f"{description}...")
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    root.after(100, poll_progress)
+
+def progress_summary():
+    elapsed = max(time.monotonic() - progress["started"], 0.001)
+    return (f"{progress[eventlog.DECREMENTED]} decremented, {progress[eventlog.NO_MATCH]} not found, "
+            f"{progress[eventlog.DUPLICATE]} duplicates, {progress[eventlog.ERROR]} errors, {progress['pages']} pages read "
+            f"({progress['updates'] / elapsed:.1f} sales/s)")
+
+def poll_progress():
+    while True:
+        try:
+            status, kind, details = progress_queue.get_nowait()
+        except queue.Empty:
+            break
+        if status == "progress":
+            if kind == "page":
+                progress["pages"] += 1
+            elif kind == "event":
+                progress[details["event_type"]] += 1
+                progress["updates"] += 1
+            continue
+        set_busy(False)
+        if status == "done":
+            kind(details)
+        elif status == "cancelled":
+            status_label.config(text=f"{progress['description']} cancelled. Sales already applied will not be applied again.")
+        else:
+            status_label.config(text="Error occurred!")
+            messagebox.showerror("Error", details)
+        return
+    status_label.config(text=f"{progress['description']}... {progress_summary()}")
+    root.after(100, poll_progress)
+
+def cancel_worker():
+    if worker is not None and worker.is_alive():
+        hipchannel.cancel_event.set()
+        status_label.config(text="Cancelling...")
+
+def set_busy(busy):
+    state = tk.DISABLED if busy else tk.NORMAL
+    run_button.config(state=state)
+    compare_button.config(state=state)
+    cancel_button.config(state=tk.NORMAL if busy else tk.DISABLED)
+
 def run_script():
-    '''Function to execute the main script and update the GUI accordingly.'''
-    
-    status_label.config(text="Syncing...")
-    root.update()
-    try:
-        hipchannel.main()
+    '''Function to start the sync on a background thread and report its progress in the GUI.'''
+
+    def on_done(result):
         completion_time = datetime.datetime.now().strftime('%H:%M:%S')
-        status_label.config(text=f"Sync Completed at {completion_time}")
-        root.update()
-    except Exception as e:
-        status_label.config(text="Error occurred!")
-        root.update()
-        messagebox.showerror("Error", str(e))
-
-def write_updated_log(contents):
-    with open("sync_log.log", 'w') as f:
-        f.writelines(contents)
-
-def clear_selected_lines(listbox):
-    selected_indices = listbox.curselection()
-    global log_contents
-    for i in selected_indices[::-1]:
-        del log_contents[i]
-        listbox.delete(i)
-    write_updated_log(log_contents)
-
-def create_clear_button(tab_frame, listbox):
+        status_label.config(text=f"Sync Completed at {completion_time}. {progress_summary()}")
+
+    start_worker(engine.sync, "Syncing", on_done)
+
+LOG_TABS = {
+    "Full Log": None,
+    "Successfully Decremented": [eventlog.DECREMENTED],
+    "No Matching Product": [eventlog.NO_MATCH],
+    "Duplicates": [eventlog.DUPLICATE],
+    "Reconciled": [eventlog.RECONCILED],
+    "Other Errors": [eventlog.ERROR],
+}
+
+def format_event(event):
+    event_id, created_at, level, event_type, platform, title, quantity, message = event
+    return f"{created_at} - {level} - {message}"
+
+def clear_selected_lines(table, count_label):
+    table.source.delete(table.selected_positions())
+    table.refresh(reset=True)
+    count_label.config(text=f"{len(table.source)} entries")
+
+def create_clear_button(tab_frame, command):
     style = ttk.Style()
     style.configure('ClearButton.TButton', font=('Helvetica', 14))
-    clear_btn = ttk.Button(tab_frame, text="Clear Selected Entries", command=lambda: clear_selected_lines(listbox), style='ClearButton.TButton')
+    clear_btn = ttk.Button(tab_frame, text="Clear Selected Entries", command=command, style='ClearButton.TButton')
     clear_btn.pack(side=tk.BOTTOM, fill=tk.X, pady=10)
 
 def view_log():
-    '''Function to display the contents of the log in a separate window.'''
-    
-    global log_contents
-
-    if not os.path.exists("sync_log.log"):
-        messagebox.showerror("Error", "sync_log.log file not found.")
-        return
-    
-    with open("sync_log.log", 'r') as f:
-        log_contents = f.readlines()
+    '''Function to display the sync events in a separate window, newest first, reading only the rows on screen.'''
 
     log_window = tk.Toplevel(root)
     log_window.title("Log Viewer")
@@ -158,64 +339,59 @@ def view_log():
     tab_control = ttk.Notebook(log_window)
     tab_control.pack(expand=1, fill="both")
 
-    tabs = {}
-    for tab_name in ["Full Log", "Successfully Decremented", "No Matching Product", "Duplicates", "Other Errors"]:
+    for tab_name, event_types in LOG_TABS.items():
         tab_frame = ttk.Frame(tab_control)
-        button_frame = ttk.Frame(tab_frame)
-        create_clear_button(button_frame, None)
-        button_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=20, pady=10)
-        listbox_frame = ttk.Frame(tab_frame)
-        tabs[tab_name] = tk.Listbox(listbox_frame, height=30)
-        tabs[tab_name].pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        v_scrollbar = tk.Scrollbar(listbox_frame, orient="vertical", command=tabs[tab_name].yview)
-        v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        listbox_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-        h_scrollbar = tk.Scrollbar(tab_frame, orient="horizontal", command=tabs[tab_name].xview)
-        h_scrollbar.pack(side=tk.TOP, fill=tk.X)
-        tabs[tab_name].configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
-        create_clear_button(tab_frame, tabs[tab_name])
+        source = EventSource(event_types)
+        table = VirtualTable(tab_frame, ("Entry",), source, column_widths={"Entry": 2400})
+        count_label = tk.Label(tab_frame, text=f"{len(source)} entries")
+        create_clear_button(tab_frame, lambda t=table, c=count_label: clear_selected_lines(t, c))
+        count_label.pack(side=tk.BOTTOM)
+        create_filter_entry(tab_frame, source, table, lambda s=source, c=count_label: c.config(text=f"{len(s)} entries"))
+        table.frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        table.refresh()
         tab_control.add(tab_frame, text=tab_name)
 
-    phrases = {
-        "Successfully Decremented": "Decremented by",
-        "No Matching Product": "No matching product found in",
-        "Duplicates": "Multiple matching products found in"
-    }
-    for line in log_contents:
-        if "[DISPLAY]" in line:
-            tabs["Full Log"].insert(tk.END, line)
-            for tab_name, phrase in phrases.items():
-                if phrase in line:
-                    tabs[tab_name].insert(tk.END, line)
-
-    error_lines = [line for line in log_contents if "[DISPLAY]" in line and all(phrase not in line for phrase in phrases.values())]
-    for line in error_lines:
-        tabs["Other Errors"].insert(tk.END, line)
-
-    for tab_name, listbox in tabs.items():
-        tab_frame = tab_control.tab(tab_name)['window']
-
-run_button = tk.Button(root, text="Run", command=run_script, font=("Helvetica", 14))
-run_button.pack(pady=20)
-run_text_label = tk.Label(root, text="This will check both HipStamp and ChannelAdvisor for new sales since the last sync. When it finds one, it will decrement the sale quantity of the corresponding product on the other platform.", font=("Helvetica", 13))
-run_text_label.pack(pady=(0, 20))
-
-view_log_button = tk.Button(root, text="View Log", command=view_log, font=("Helvetica", 14))
-view_log_button.pack(pady=20)
-view_log_text_label = tk.Label(root, text="See which products got updated and which products couldn't get updated.", font=("Helvetica", 13))
-view_log_text_label.pack(pady=(0, 20))
-
-compare_button = tk.Button(root, text="Compare Quantities", command=compare_quantities, font=("Helvetica", 14))
-compare_button.pack(pady=20)
-compare_text_label = tk.Label(root, text="This will display all products whose quantities differ between HipStamp and ChannelAdvisor.", font=("Helvetica", 13))
-compare_text_label.pack(pady=(0, 20))
-
-settings_button = tk.Button(root, text="Settings", command=settings, font=("Helvetica", 14))
-settings_button.pack(pady=20)
-settings_text_label = tk.Label(root, text="Configure settings.", font=("Helvetica", 13))
-settings_text_label.pack(pady=(0, 20))
-
-status_label = tk.Label(root, text="")
-status_label.pack(pady=20)
-
-root.mainloop()
\ No newline at end of file
+def main(config_file='config.json'):
+    global root, engine, run_button, compare_button, cancel_button, status_label
+    hipchannel.configure_logging()
+    try:
+        engine = hipchannel.SyncEngine(config_file)
+    except hipchannel.ConfigError as e:
+        messagebox.showerror("Configuration Error", str(e))
+        return
+
+    root = tk.Tk()
+    root.title("HipStamp / ChannelAdvisor Synchronizer")
+    title_label = tk.Label(root, text="Welcome to the HipStamp / ChannelAdvisor Inventory Sync App!", font=("Helvetica", 16))
+    title_label.pack(pady=(10, 0))
+
+    run_button = tk.Button(root, text="Run", command=run_script, font=("Helvetica", 14))
+    run_button.pack(pady=20)
+    run_text_label = tk.Label(root, text="This will check both HipStamp and ChannelAdvisor for new sales since the last sync. When it finds one, it will decrement the sale quantity of the corresponding product on the other platform.", font=("Helvetica", 13))
+    run_text_label.pack(pady=(0, 20))
+
+    view_log_button = tk.Button(root, text="View Log", command=view_log, font=("Helvetica", 14))
+    view_log_button.pack(pady=20)
+    view_log_text_label = tk.Label(root, text="See which products got updated and which products couldn't get updated.", font=("Helvetica", 13))
+    view_log_text_label.pack(pady=(0, 20))
+
+    compare_button = tk.Button(root, text="Compare Quantities", command=compare_quantities, font=("Helvetica", 14))
+    compare_button.pack(pady=20)
+    compare_text_label = tk.Label(root, text="This will display all products whose quantities differ between HipStamp and ChannelAdvisor.", font=("Helvetica", 13))
+    compare_text_label.pack(pady=(0, 20))
+
+    settings_button = tk.Button(root, text="Settings", command=settings, font=("Helvetica", 14))
+    settings_button.pack(pady=20)
+    settings_text_label = tk.Label(root, text="Configure settings.", font=("Helvetica", 13))
+    settings_text_label.pack(pady=(0, 20))
+
+    cancel_button = tk.Button(root, text="Cancel", command=cancel_worker, font=("Helvetica", 14), state=tk.DISABLED)
+    cancel_button.pack(pady=(0, 10))
+
+    status_label = tk.Label(root, text="")
+    status_label.pack(pady=20)
+
+    root.mainloop()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,126 @@
+import sqlite3
+import json
+import datetime
+import logging
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    platform TEXT NOT NULL,
+    taken_at TEXT NOT NULL,
+    full INTEGER NOT NULL,
+    fetched INTEGER NOT NULL,
+    changed INTEGER NOT NULL,
+    removed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    platform TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    title TEXT,
+    quantity INTEGER,
+    record TEXT NOT NULL,
+    PRIMARY KEY (platform, sku)
+);
+CREATE TABLE IF NOT EXISTS deltas (
+    version INTEGER NOT NULL,
+    platform TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    title TEXT,
+    change TEXT NOT NULL,
+    old_quantity INTEGER,
+    new_quantity INTEGER
+);
+CREATE INDEX IF NOT EXISTS deltas_by_sku ON deltas (platform, sku);
+CREATE INDEX IF NOT EXISTS deltas_by_version ON deltas (version);
+"""
+
+class InventoryStore:
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.connection = sqlite3.connect(db_file)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def last_snapshot_time(self, platform, full_only=False):
+        query = "SELECT taken_at FROM snapshots WHERE platform = ?"
+        if full_only:
+            query += " AND full = 1"
+        row = self.connection.execute(query + " ORDER BY version DESC LIMIT 1", (platform,)).fetchone()
+        return row[0] if row else None
+
+    def record_snapshot(self, platform, records, sku_key, title_key, quantity_key, full, taken_at=None):
+        # Only items whose record differs from the stored copy are written, each with a delta row.
+        # A full snapshot also removes items that no longer came back from the API.
+        if taken_at is None:
+            taken_at = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        cursor = self.connection.cursor()
+        cursor.execute("INSERT INTO snapshots (platform, taken_at, full, fetched, changed, removed) VALUES (?, ?, ?, 0, 0, 0)",
+                       (platform, taken_at, int(full)))
+        version = cursor.lastrowid
+        fetched = changed = 0
+        seen = set()
+        try:
+            for record in records:
+                if sku_key not in record:
+                    logging.warning(f"{platform} record without {sku_key} left out of the snapshot: {record}")
+                    continue
+                sku = str(record[sku_key])
+                title = record.get(title_key)
+                quantity = record.get(quantity_key)
+                serialized = json.dumps(record, sort_keys=True, separators=(',', ':'))
+                fetched += 1
+                if full:
+                    seen.add(sku)
+                existing = cursor.execute("SELECT quantity, record FROM items WHERE platform = ? AND sku = ?",
+                                          (platform, sku)).fetchone()
+                if existing is not None and existing[1] == serialized:
+                    continue
+                cursor.execute("INSERT OR REPLACE INTO items (platform, sku, title, quantity, record) VALUES (?, ?, ?, ?, ?)",
+                               (platform, sku, title, quantity, serialized))
+                cursor.execute("INSERT INTO deltas (version, platform, sku, title, change, old_quantity, new_quantity) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (version, platform, sku, title, "added" if existing is None else "changed",
+                                None if existing is None else existing[0], quantity))
+                changed += 1
+
+            removed = 0
+            if full:
+                stored = cursor.execute("SELECT sku, title, quantity FROM items WHERE platform = ?", (platform,)).fetchall()
+                for sku, title, quantity in stored:
+                    if sku in seen:
+                        continue
+                    cursor.execute("DELETE FROM items WHERE platform = ? AND sku = ?", (platform, sku))
+                    cursor.execute("INSERT INTO deltas (version, platform, sku, title, change, old_quantity, new_quantity) VALUES (?, ?, ?, ?, 'removed', ?, NULL)",
+                                   (version, platform, sku, title, quantity))
+                    removed += 1
+
+            cursor.execute("UPDATE snapshots SET fetched = ?, changed = ?, removed = ? WHERE version = ?",
+                           (fetched, changed, removed, version))
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        logging.info(f"Recorded {platform} snapshot {version} ({'full' if full else 'incremental'}): {fetched} fetched, {changed} changed, {removed} removed.")
+        return version
+
+    def iter_items(self, platform):
+        for (record,) in self.connection.execute("SELECT record FROM items WHERE platform = ?", (platform,)):
+            yield json.loads(record)
+
+    def iter_summaries(self, platform):
+        # (sku, title, quantity) from the indexed columns, without parsing each stored record
+        yield from self.connection.execute("SELECT sku, title, quantity FROM items WHERE platform = ?", (platform,))
+
+    def history(self, platform, sku):
+        return self.connection.execute(
+            "SELECT deltas.version, snapshots.taken_at, deltas.change, deltas.old_quantity, deltas.new_quantity "
+            "FROM deltas JOIN snapshots ON snapshots.version = deltas.version "
+            "WHERE deltas.platform = ? AND deltas.sku = ? ORDER BY deltas.version",
+            (platform, str(sku))).fetchall()
@@ -0,0 +1,342 @@
+import argparse
+import datetime
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A local stand-in for the HipStamp and ChannelAdvisor endpoints hipchannel calls, for trying changes
+# and benchmarking without touching the live stores. Point HIPSTAMP_API_ENDPOINT,
+# CHANNEL_ADVISOR_API_ENDPOINT and CHANNEL_ADVISOR_TOKEN_URL at the URLs from MockServer.endpoints().
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def parse_time(timestamp):
+    parsed = datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+def generate_catalog(skus, hipstamp_sales, channeladvisor_sales, seed=0, max_lines=3, start_time=None):
+    # The same titles are listed on both platforms, each sale sells 1-2 of up to max_lines random products
+    rng = random.Random(seed)
+    if start_time is None:
+        start_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=1)
+    listings, products = [], []
+    for i in range(skus):
+        title = f"Test Stamp {i:06d} Mint Block of {rng.randint(1, 12)}"
+        quantity = rng.randint(50, 500)
+        listings.append({'id': 100000 + i, 'name': title, 'quantity': quantity})
+        products.append({'ID': 500000 + i, 'Title': title, 'TotalAvailableQuantity': quantity,
+                         'UpdateDateUtc': utc_now(), 'QuantityUpdateDateUtc': utc_now()})
+
+    def sale_lines(records, quantity_key):
+        # Each platform has already taken its own sales off its quantities, as the real ones do
+        lines = [(rng.randrange(skus), rng.randint(1, 2)) for _ in range(rng.randint(1, max_lines))]
+        for sku, quantity in lines:
+            records[sku][quantity_key] -= quantity
+        return lines
+
+    sales = []
+    for i in range(hipstamp_sales):
+        created = (start_time + datetime.timedelta(seconds=i)).isoformat()
+        sales.append({'id': 700000 + i, 'created_at': created, 'SaleListings': [
+            {'id': 7000000 + i * 10 + position, 'listing_name': listings[sku]['name'], 'quantity': quantity}
+            for position, (sku, quantity) in enumerate(sale_lines(listings, 'quantity'))]})
+    orders = []
+    for i in range(channeladvisor_sales):
+        created = (start_time + datetime.timedelta(seconds=i)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        orders.append({'ID': 900000 + i, 'CreatedDateUtc': created, 'Items': [
+            {'ID': 9000000 + i * 10 + position, 'Title': products[sku]['Title'], 'Quantity': quantity}
+            for position, (sku, quantity) in enumerate(sale_lines(products, 'TotalAvailableQuantity'))]})
+    return listings, products, sales, orders
+
+class MockStores:
+    # Both platforms' data plus counters of what was asked of them. Shared by the handler threads.
+    def __init__(self, listings, products, sales, orders):
+        self.lock = threading.Lock()
+        self.listings = {listing['id']: listing for listing in listings}
+        self.products = {product['ID']: product for product in products}
+        self.sales = sales
+        self.orders = orders
+        self.requests = {}
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def count(self, route, received, sent):
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            self.bytes_received += received
+            self.bytes_sent += sent
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': dict(self.requests),
+                'total_requests': sum(self.requests.values()),
+                'bytes_received': self.bytes_received,
+                'bytes_sent': self.bytes_sent,
+                'rate_limited': self.rate_limited,
+                'failed': self.failed,
+            }
+
+    def quantities(self):
+        with self.lock:
+            return ({listing_id: listing['quantity'] for listing_id, listing in self.listings.items()},
+                    {product_id: product['TotalAvailableQuantity'] for product_id, product in self.products.items()})
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; with Nagle on, keep-alive clients stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def handle_request(self, method):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        parsed = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        if parsed.path == "/mock/state":
+            self.respond(*self.state())
+            return
+        route, handler, match = self.route(method, parsed.path)
+
+        if server.latency:
+            time.sleep(max(0, server.latency + random.uniform(-server.jitter, server.jitter)))
+        with server.fault_lock:
+            server.request_number += 1
+            request_number = server.request_number
+            fail = server.failure_rate and random.random() < server.failure_rate
+        if server.rate_limit_every and request_number % server.rate_limit_every == 0:
+            with server.stores.lock:
+                server.stores.rate_limited += 1
+            status, headers, payload = 429, {"Retry-After": str(server.retry_after)}, b'{"error": "Too Many Requests"}'
+        elif fail:
+            with server.stores.lock:
+                server.stores.failed += 1
+            status, headers, payload = server.failure_status, {}, b'{"error": "Injected failure"}'
+        elif handler is None:
+            status, headers, payload = 404, {}, b'{"error": "Not Found"}'
+        else:
+            status, headers, payload = handler(match, query, body)
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload).encode()
+            headers.setdefault("Content-Type", "application/json")
+        server.stores.count(route, len(self.path) + length, len(payload))
+        self.respond(status, headers, payload)
+
+    def respond(self, status, headers, payload):
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload).encode()
+            headers.setdefault("Content-Type", "application/json")
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def route(self, method, path):
+        username = re.escape(self.server.hipstamp_username)
+        routes = [
+            ("POST", r"/channeladvisor/oauth2/token", "ChannelAdvisor token", self.token),
+            ("GET", rf"/hipstamp/stores/{username}/listings/active", "HipStamp listings", self.hipstamp_listings),
+            ("GET", rf"/hipstamp/stores/{username}/sales/paid", "HipStamp sales", self.hipstamp_sales),
+            ("PUT", r"/hipstamp/listings/(\d+)", "HipStamp update", self.hipstamp_update),
+            ("GET", r"/channeladvisor/v1/Products", "ChannelAdvisor products", self.channeladvisor_products),
+            ("GET", r"/channeladvisor/v1/Orders", "ChannelAdvisor orders", self.channeladvisor_orders),
+            ("POST", r"/channeladvisor/v1/\$batch", "ChannelAdvisor batch", self.channeladvisor_batch),
+        ]
+        for route_method, pattern, route, handler in routes:
+            match = re.fullmatch(pattern, path)
+            if match and route_method == method:
+                return route, handler, match
+        return f"{method} {path}", None, None
+
+    def state(self):
+        # Lets a harness running the server in another process read the counters and final quantities
+        hipstamp_quantities, channeladvisor_quantities = self.server.stores.quantities()
+        return 200, {}, {"stats": self.server.stores.stats(), "hipstamp_quantities": hipstamp_quantities,
+                         "channeladvisor_quantities": channeladvisor_quantities}
+
+    def token(self, match, query, body):
+        return 200, {}, {"access_token": f"mock-token-{time.time()}", "expires_in": 3600}
+
+    def hipstamp_listings(self, match, query, body):
+        stores = self.server.stores
+        keywords = query.get('keywords', '').casefold()
+        page, limit = int(query.get('page', 1)), int(query.get('limit', 100))
+        with stores.lock:
+            if keywords:
+                matches = [listing for listing in stores.listings.values() if keywords in listing['name'].casefold()]
+            else:
+                matches = list(stores.listings.values())
+            return 200, {}, {"count": len(matches), "results": [dict(listing) for listing in matches[(page - 1) * limit:page * limit]]}
+
+    def hipstamp_sales(self, match, query, body):
+        sales = self.server.stores.sales
+        if 'created_time_from' in query:
+            since = parse_time(query['created_time_from'])
+            sales = [sale for sale in sales if parse_time(sale['created_at']) >= since]
+        page, limit = int(query.get('page', 1)), int(query.get('limit', 100))
+        return 200, {}, {"count": len(sales), "results": sales[(page - 1) * limit:page * limit]}
+
+    def hipstamp_update(self, match, query, body):
+        stores = self.server.stores
+        listing_id = int(match.group(1))
+        with stores.lock:
+            listing = stores.listings.get(listing_id)
+            if listing is None:
+                return 404, {}, {"error": f"Listing {listing_id} not found"}
+            listing['quantity'] = int(query['quantity'])
+            return 200, {}, dict(listing)
+
+    def channeladvisor_page(self, query, records):
+        skip = int(query.get('$skip', 0))
+        page_size = self.server.channeladvisor_page_size
+        with self.server.stores.lock:
+            page = {"value": [dict(record) for record in records[skip:skip + page_size]]}
+        if skip + page_size < len(records):
+            next_query = urllib.parse.urlencode({**query, '$skip': skip + page_size})
+            page["@odata.nextLink"] = f"{self.server.base_url}{urllib.parse.urlsplit(self.path).path}?{next_query}"
+        return 200, {}, page
+
+    def channeladvisor_products(self, match, query, body):
+        stores = self.server.stores
+        odata_filter = query.get('$filter', '')
+        with stores.lock:
+            products = list(stores.products.values())
+        title = re.fullmatch(r"Title eq '(.*)'", odata_filter)
+        # Like ChannelAdvisor, a quantity change only moves QuantityUpdateDateUtc, not UpdateDateUtc
+        updated = [re.fullmatch(r"((?:Quantity)?UpdateDateUtc) ge (\S+)", clause) for clause in odata_filter.split(" or ")]
+        if title:
+            wanted = title.group(1).replace("''", "'")
+            products = [product for product in products if product['Title'] == wanted]
+        elif odata_filter and all(updated):
+            products = [product for product in products
+                        if any(parse_time(product.get(clause.group(1), product['UpdateDateUtc'])) >= parse_time(clause.group(2)) for clause in updated)]
+        return self.channeladvisor_page(query, products)
+
+    def channeladvisor_orders(self, match, query, body):
+        orders = self.server.stores.orders
+        created = re.fullmatch(r"CreatedDateUtc ge (\S+)", query.get('$filter', ''))
+        if created:
+            since = parse_time(created.group(1))
+            orders = [order for order in orders if parse_time(order['CreatedDateUtc']) >= since]
+        return self.channeladvisor_page(query, orders)
+
+    def channeladvisor_batch(self, match, query, body):
+        stores = self.server.stores
+        boundary = re.search(r'boundary="?([^";]+)"?', self.headers.get("Content-Type", ""))
+        if boundary is None:
+            return 400, {}, {"error": "Missing multipart boundary"}
+        response_boundary = f"batchresponse_{time.time_ns()}"
+        lines = []
+        for position, part in enumerate(body.decode().split(f"--{boundary.group(1)}")[1:-1], start=1):
+            content_id = re.search(r"Content-ID:\s*(\d+)", part, re.IGNORECASE)
+            content_id = content_id.group(1) if content_id else str(position)
+            request_line = re.search(r"POST /v1/Products\((\d+)\)/UpdateQuantity HTTP/1\.1", part)
+            status = "400 Bad Request"
+            if request_line:
+                payload = json.loads(part.split("\r\n\r\n")[-1])
+                quantity = sum(update['Quantity'] for update in payload['Value']['Updates'])
+                with stores.lock:
+                    product = stores.products.get(int(request_line.group(1)))
+                    if product is None:
+                        status = "404 Not Found"
+                    else:
+                        if payload['Value']['UpdateType'] == "Absolute":
+                            product['TotalAvailableQuantity'] = quantity
+                        else:
+                            product['TotalAvailableQuantity'] += quantity
+                        product['QuantityUpdateDateUtc'] = utc_now()
+                        status = "204 No Content"
+            lines += [f"--{response_boundary}", "Content-Type: application/http", "Content-Transfer-Encoding: binary",
+                      f"Content-ID: {content_id}", "", f"HTTP/1.1 {status}", ""]
+        lines.append(f"--{response_boundary}--")
+        return 200, {"Content-Type": f"multipart/mixed; boundary={response_boundary}"}, ("\r\n".join(lines) + "\r\n").encode()
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, stores, port=0, hipstamp_username="mockstore", latency=0.0, jitter=0.0, channeladvisor_page_size=100,
+                 rate_limit_every=0, retry_after=1, failure_rate=0.0, failure_status=503):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.stores = stores
+        self.hipstamp_username = hipstamp_username
+        self.latency = latency
+        self.jitter = min(jitter, latency)
+        self.channeladvisor_page_size = channeladvisor_page_size
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.fault_lock = threading.Lock()
+        self.request_number = 0
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.thread = None
+
+    def endpoints(self):
+        return {
+            "HIPSTAMP_API_ENDPOINT": f"{self.base_url}/hipstamp",
+            "CHANNEL_ADVISOR_API_ENDPOINT": f"{self.base_url}/channeladvisor",
+            "CHANNEL_ADVISOR_TOKEN_URL": f"{self.base_url}/channeladvisor/oauth2/token",
+            "HIPSTAMP_USERNAME": self.hipstamp_username,
+        }
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def serve(catalog, options, ready):
+    # Process target: serves the catalog and sends the endpoints back through the ready queue
+    server = MockServer(MockStores(*catalog), **options)
+    ready.put(server.endpoints())
+    server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake HipStamp and ChannelAdvisor APIs locally.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--skus", type=int, default=1000, help="products listed on each platform")
+    parser.add_argument("--sales", type=int, default=100, help="sales waiting on each platform")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth request with a 429")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    args = parser.parse_args()
+
+    stores = MockStores(*generate_catalog(args.skus, args.sales, args.sales))
+    server = MockServer(stores, port=args.port, latency=args.latency, rate_limit_every=args.rate_limit_every,
+                        failure_rate=args.failure_rate)
+    print("Add these settings to a copy of config.json:")
+    print(json.dumps(server.endpoints(), indent=2))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        print(json.dumps(stores.stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import csv
+import re
+import sys
+import unicodedata
+from collections import Counter, defaultdict, deque
+
+MATCH_EXACT = "exact"
+MATCH_NORMALIZED = "normalized"
+MATCH_FUZZY = "fuzzy"
+HIPSTAMP_ONLY = "HipStamp only"
+CHANNEL_ADVISOR_ONLY = "ChannelAdvisor only"
+
+DEFAULT_FUZZY_THRESHOLD = 0.8
+FUZZY_CANDIDATES = 5
+# Trigrams shared by more titles than this (e.g. " us", "ps ") say nothing about a match and
+# would make every title a candidate for every other one.
+MAX_TRIGRAM_POSTINGS = 1000
+RARE_TRIGRAMS = 8
+
+def normalize_title(title):
+    title = unicodedata.normalize("NFKC", str(title)).casefold()
+    title = re.sub(r"[^\w]+", " ", title)
+    return " ".join(title.split())
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class ComparisonResult:
+    # Rows are held as parallel columns rather than one dict per row
+    __slots__ = ("hip_ids", "hip_titles", "hip_quantities", "ca_ids", "ca_titles", "ca_quantities", "match_types", "scores")
+
+    columns = ("HipStamp Title", "HipStamp Quantity", "ChannelAdvisor Title", "ChannelAdvisor Quantity", "Match")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, [])
+
+    def __len__(self):
+        return len(self.match_types)
+
+    def append(self, hip_id, hip_title, hip_quantity, ca_id, ca_title, ca_quantity, match_type, score):
+        self.hip_ids.append(hip_id)
+        self.hip_titles.append(hip_title)
+        self.hip_quantities.append(hip_quantity)
+        self.ca_ids.append(ca_id)
+        self.ca_titles.append(ca_title)
+        self.ca_quantities.append(ca_quantity)
+        self.match_types.append(match_type)
+        self.scores.append(score)
+
+    def row(self, i):
+        # Display row in the same shape as the Compare Quantities table, with "N/A" for the missing side
+        match_type = self.match_types[i]
+        if match_type == MATCH_FUZZY:
+            match_type = f"{MATCH_FUZZY} ({self.scores[i]:.2f})"
+        return (
+            "N/A" if self.hip_titles[i] is None else self.hip_titles[i],
+            "N/A" if self.hip_quantities[i] is None else self.hip_quantities[i],
+            "N/A" if self.ca_titles[i] is None else self.ca_titles[i],
+            "N/A" if self.ca_quantities[i] is None else self.ca_quantities[i],
+            match_type,
+        )
+
+    def rows(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def sort_key(self, column):
+        # Key for sorting row positions by a display column; missing values sort last
+        values = (self.hip_titles, self.hip_quantities, self.ca_titles, self.ca_quantities, self.match_types)[column]
+
+        def key(i):
+            value = values[i]
+            if value is None:
+                return (2, "")
+            if isinstance(value, (int, float)):
+                return (0, value)
+            return (1, str(value).casefold())
+        return key
+
+    def write_csv(self, f):
+        writer = csv.writer(f)
+        writer.writerow(self.columns)
+        writer.writerows(self.rows())
+
+def compare_inventories(hip_inventory_items, ca_inventory_items, fuzzy_threshold=DEFAULT_FUZZY_THRESHOLD, all_matches=False):
+    # Both sides are records.InventoryItem. Only rows that need attention are returned: quantity differences, products found on one
+    # platform only, and normalized and fuzzy matches (the sync itself matches titles exactly, so those
+    # titles need fixing even when the quantities agree). With all_matches, exact matches whose
+    # quantities agree are returned as well.
+    ca_ids, ca_titles, ca_quantities = [], [], []
+    ca_by_title = defaultdict(deque)
+    ca_by_key = defaultdict(deque)
+    for item in ca_inventory_items:
+        position = len(ca_titles)
+        ca_ids.append(item.id)
+        ca_titles.append(item.title)
+        ca_quantities.append(item.quantity)
+        ca_by_title[item.title].append(position)
+        ca_by_key[normalize_title(item.title)].append(position)
+    ca_matched = bytearray(len(ca_titles))
+
+    def take(candidates):
+        while candidates:
+            position = candidates.popleft()
+            if not ca_matched[position]:
+                ca_matched[position] = 1
+                return position
+        return None
+
+    result = ComparisonResult()
+    unmatched_hip = []
+    for hip_item in hip_inventory_items:
+        hip_title = hip_item.title
+        hip_quantity = hip_item.quantity
+        match_type = MATCH_EXACT
+        position = take(ca_by_title.get(hip_title, deque()))
+        if position is None:
+            match_type = MATCH_NORMALIZED
+            position = take(ca_by_key.get(normalize_title(hip_title), deque()))
+        if position is None:
+            unmatched_hip.append((hip_item.id, hip_title, hip_quantity))
+        elif all_matches or match_type == MATCH_NORMALIZED or hip_quantity != ca_quantities[position]:
+            result.append(hip_item.id, hip_title, hip_quantity, ca_ids[position], ca_titles[position],
+                          ca_quantities[position], match_type, 1.0)
+    del ca_by_title, ca_by_key
+
+    # Fuzzy matching only looks at what is left over, and only at CA titles that share a
+    # reasonably rare trigram with the HipStamp title, so it stays far from quadratic.
+    postings = defaultdict(list)
+    ca_trigrams = {}
+    if fuzzy_threshold is not None and unmatched_hip:
+        for position in range(len(ca_titles)):
+            if not ca_matched[position]:
+                grams = trigrams(normalize_title(ca_titles[position]))
+                ca_trigrams[position] = grams
+                for gram in grams:
+                    postings[gram].append(position)
+
+    for hip_id, hip_title, hip_quantity in unmatched_hip:
+        best_position, best_score = None, 0.0
+        if ca_trigrams:
+            hip_grams = trigrams(normalize_title(hip_title))
+            # A close match has to share most trigrams, so its rarest ones are enough to find it
+            rare_grams = sorted((len(postings[gram]), gram) for gram in hip_grams if gram in postings)[:RARE_TRIGRAMS]
+            shared = Counter()
+            for count, gram in rare_grams:
+                if count <= MAX_TRIGRAM_POSTINGS:
+                    shared.update(postings[gram])
+            for position, _ in shared.most_common(FUZZY_CANDIDATES):
+                if ca_matched[position]:
+                    continue
+                ca_grams = ca_trigrams[position]
+                score = len(hip_grams & ca_grams) / len(hip_grams | ca_grams)
+                if score > best_score:
+                    best_position, best_score = position, score
+        if best_position is not None and best_score >= fuzzy_threshold:
+            ca_matched[best_position] = 1
+            result.append(hip_id, hip_title, hip_quantity, ca_ids[best_position], ca_titles[best_position],
+                          ca_quantities[best_position], MATCH_FUZZY, best_score)
+        else:
+            result.append(hip_id, hip_title, hip_quantity, None, None, None, HIPSTAMP_ONLY, None)
+
+    for position in range(len(ca_titles)):
+        if not ca_matched[position]:
+            result.append(None, None, None, ca_ids[position], ca_titles[position], ca_quantities[position],
+                          CHANNEL_ADVISOR_ONLY, None)
+    return result
+
+PLAN_COLUMNS = ("HipStamp Title", "HipStamp Quantity", "ChannelAdvisor Title", "ChannelAdvisor Quantity", "Match",
+                "Pending HipStamp Sales", "Pending ChannelAdvisor Sales", "Target Quantity", "Updates", "Status")
+
+def plan_reconciliation(result, source, pending_hipstamp=None, pending_channeladvisor=None, include_fuzzy=False):
+    # Absolute target quantities for the matched products in a comparison. The source of truth's
+    # quantity stands, less sales made on the other platform that have not been applied to it yet;
+    # both platforms are set to that. pending_* map a platform's titles to the [(ledger_key, quantity)]
+    # sold there and not yet applied to the other platform. Products on one platform only, and fuzzy
+    # matches unless include_fuzzy, are left alone, as are matched products whose quantities agree and
+    # that have no pending sales. Matched products missing a quantity on either side are listed with
+    # the status "skipped" and not updated.
+    pending_hipstamp = pending_hipstamp or {}
+    pending_channeladvisor = pending_channeladvisor or {}
+    changes = []
+    for i in range(len(result)):
+        match_type = result.match_types[i]
+        if match_type in (HIPSTAMP_ONLY, CHANNEL_ADVISOR_ONLY) or (match_type == MATCH_FUZZY and not include_fuzzy):
+            continue
+        hip_title, ca_title = result.hip_titles[i], result.ca_titles[i]
+        hipstamp_lines = pending_hipstamp.get(hip_title, [])
+        channeladvisor_lines = pending_channeladvisor.get(ca_title, [])
+        try:
+            hip_quantity, ca_quantity = int(result.hip_quantities[i]), int(result.ca_quantities[i])
+        except (TypeError, ValueError):
+            changes.append({
+                'hip_id': result.hip_ids[i],
+                'hip_title': hip_title,
+                'hip_quantity': result.hip_quantities[i],
+                'ca_id': result.ca_ids[i],
+                'ca_title': ca_title,
+                'ca_quantity': result.ca_quantities[i],
+                'match_type': result.row(i)[4],
+                'pending_hipstamp': hipstamp_lines,
+                'pending_channeladvisor': channeladvisor_lines,
+                'target': None,
+                'set_hipstamp': False,
+                'set_channeladvisor': False,
+                'status': "skipped",
+            })
+            continue
+        if hip_quantity == ca_quantity and not hipstamp_lines and not channeladvisor_lines:
+            continue
+        if source == "HipStamp":
+            target = hip_quantity - sum(quantity for _, quantity in channeladvisor_lines)
+        else:
+            target = ca_quantity - sum(quantity for _, quantity in hipstamp_lines)
+        target = max(target, 0)
+        changes.append({
+            'hip_id': result.hip_ids[i],
+            'hip_title': hip_title,
+            'hip_quantity': hip_quantity,
+            'ca_id': result.ca_ids[i],
+            'ca_title': ca_title,
+            'ca_quantity': ca_quantity,
+            'match_type': result.row(i)[4],
+            'pending_hipstamp': hipstamp_lines,
+            'pending_channeladvisor': channeladvisor_lines,
+            'target': target,
+            'set_hipstamp': hip_quantity != target,
+            'set_channeladvisor': ca_quantity != target,
+            'status': "planned",
+        })
+    return changes
+
+def write_plan_csv(changes, f):
+    writer = csv.writer(f)
+    writer.writerow(PLAN_COLUMNS)
+    for change in changes:
+        updates = [platform for platform, flag in (("HipStamp", change['set_hipstamp']), ("ChannelAdvisor", change['set_channeladvisor'])) if flag]
+        writer.writerow((change['hip_title'], change['hip_quantity'], change['ca_title'], change['ca_quantity'], change['match_type'],
+                         sum(quantity for _, quantity in change['pending_hipstamp']),
+                         sum(quantity for _, quantity in change['pending_channeladvisor']),
+                         "N/A" if change['target'] is None else change['target'], " and ".join(updates) or "none", change['status']))
+
+def main(argv=None):
+    # Kept so `python reconcile.py` still works; the compare command lives in cli.py
+    import cli
+    return cli.main(["compare"] + list(sys.argv[1:] if argv is None else argv))
+
+if __name__ == "__main__":
+    sys.exit(main())
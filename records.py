@@ -0,0 +1,90 @@
+import logging
+
+# The sales and inventory the sync holds in memory, parsed out of the API responses with only the
+# fields the sync reads. __slots__ keeps each record to a few pointers instead of a dict.
+
+class SaleLine:
+    # One HipStamp sale listing or ChannelAdvisor order item
+    __slots__ = ("ledger_key", "title", "quantity")
+
+    def __init__(self, ledger_key, title, quantity):
+        self.ledger_key = ledger_key
+        self.title = title
+        self.quantity = quantity
+
+    def __repr__(self):
+        return f"SaleLine({self.ledger_key!r}, {self.title!r}, {self.quantity!r})"
+
+class Sale:
+    __slots__ = ("created", "lines")
+
+    def __init__(self, created, lines):
+        self.created = created
+        self.lines = lines
+
+    def __repr__(self):
+        return f"Sale({self.created!r}, {self.lines!r})"
+
+class InventoryItem:
+    # A product or listing, as held in the title indexes and read back from the snapshot store.
+    # ChannelAdvisor index entries carry no quantity.
+    __slots__ = ("id", "title", "quantity")
+
+    def __init__(self, id, title, quantity=None):
+        self.id = id
+        self.title = title
+        self.quantity = quantity
+
+    def __eq__(self, other):
+        if not isinstance(other, InventoryItem):
+            return NotImplemented
+        return (self.id, self.title, self.quantity) == (other.id, other.title, other.quantity)
+
+    def __repr__(self):
+        return f"InventoryItem({self.id!r}, {self.title!r}, {self.quantity!r})"
+
+    def to_index_entry(self):
+        # The shape the title index files have always used
+        if self.quantity is None:
+            return {'id': self.id}
+        return {'id': self.id, 'quantity': self.quantity}
+
+def hipstamp_ledger_key(sale, listing, position):
+    return f"{sale.get('id')}:{listing.get('id', position)}"
+
+def channeladvisor_ledger_key(sale, item, position):
+    return f"{sale.get('ID')}:{item.get('ID', position)}"
+
+def sale_quantity(platform, ledger_key, value):
+    # Quantities sometimes arrive as strings. A line whose quantity is unusable is left out, so it is
+    # never marked applied and gets logged again on the next run.
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        logging.error(f"Skipping {platform} sale line {ledger_key} with quantity {value!r}.")
+        return None
+
+def parse_hipstamp_sale(sale, created_field):
+    # A sale without an id gets no lines: its ledger keys would collide with every other such sale
+    if sale.get('id') is None:
+        logging.error(f"Skipping HipStamp sale without an id: {sale}")
+        return Sale(sale.get(created_field), [])
+    lines = []
+    for position, listing in enumerate(sale['SaleListings']):
+        ledger_key = hipstamp_ledger_key(sale, listing, position)
+        quantity = sale_quantity("HipStamp", ledger_key, listing.get('quantity'))
+        if quantity is not None:
+            lines.append(SaleLine(ledger_key, listing.get('listing_name') or '', quantity))
+    return Sale(sale.get(created_field), lines)
+
+def parse_channeladvisor_sale(sale):
+    if sale.get('ID') is None:
+        logging.error(f"Skipping ChannelAdvisor order without an ID: {sale}")
+        return Sale(sale.get('CreatedDateUtc'), [])
+    lines = []
+    for position, item in enumerate(sale.get('Items', [])):
+        ledger_key = channeladvisor_ledger_key(sale, item, position)
+        quantity = sale_quantity("ChannelAdvisor", ledger_key, item.get('Quantity'))
+        if quantity is not None:
+            lines.append(SaleLine(ledger_key, item.get('Title') or '', quantity))
+    return Sale(sale.get('CreatedDateUtc'), lines)
@@ -0,0 +1,80 @@
+import sqlite3
+import datetime
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS applied_sales (
+    platform TEXT NOT NULL,
+    sale_key TEXT NOT NULL,
+    applied_at TEXT NOT NULL,
+    PRIMARY KEY (platform, sale_key)
+);
+CREATE TABLE IF NOT EXISTS failed_sales (
+    platform TEXT NOT NULL,
+    sale_key TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    failed_at TEXT NOT NULL,
+    PRIMARY KEY (platform, sale_key)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    platform TEXT PRIMARY KEY,
+    created_since TEXT NOT NULL
+);
+"""
+
+class SaleLedger:
+    # Records every sale line whose decrement has been applied, keyed by the platform it sold on,
+    # plus the newest sale creation time seen per platform. Shared by the update worker threads.
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_file, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def is_applied(self, platform, sale_key):
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM applied_sales WHERE platform = ? AND sale_key = ?",
+                                          (platform, sale_key)).fetchone()
+        return row is not None
+
+    def mark_applied(self, platform, sale_key):
+        # Committed immediately so a crash right after a decrement never replays it
+        applied_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with self.lock:
+            self.connection.execute("INSERT OR IGNORE INTO applied_sales (platform, sale_key, applied_at) VALUES (?, ?, ?)",
+                                    (platform, sale_key, applied_at))
+            self.connection.commit()
+
+    def mark_failed(self, platform, sale_key, reason):
+        # For lines that cannot be applied however often they are retried, such as a title with no match
+        failed_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO failed_sales (platform, sale_key, reason, failed_at) VALUES (?, ?, ?, ?)",
+                                    (platform, sale_key, reason, failed_at))
+            self.connection.commit()
+
+    def has_failed(self, platform, sale_key):
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM failed_sales WHERE platform = ? AND sale_key = ?",
+                                          (platform, sale_key)).fetchone()
+        return row is not None
+
+    def get_watermark(self, platform):
+        with self.lock:
+            row = self.connection.execute("SELECT created_since FROM watermarks WHERE platform = ?", (platform,)).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, platform, created_since):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO watermarks (platform, created_since) VALUES (?, ?)",
+                                    (platform, created_since))
+            self.connection.commit()
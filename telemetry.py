@@ -0,0 +1,209 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Upper bounds in seconds; the last bucket catches everything slower
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf"))
+
+def format_labels(labels):
+    return ",".join(f'{name}="{escape_label(value)}"' for name, value in labels)
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, fraction):
+        # Interpolated within the bucket the quantile falls in, as Prometheus' histogram_quantile does
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            if seen + count >= rank and count:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return lower
+
+class Metrics:
+    # Counters, latency histograms and phase timings for every API call hipchannel makes.
+    # Shared by the update worker threads.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.latencies = {}
+            self.retries = {}
+            self.errors = {}
+            self.bytes_sent = {}
+            self.bytes_received = {}
+            self.rate_limit_wait = {}
+            self.phases = {}
+            self.started = time.time()
+
+    def observe_request(self, platform, endpoint, method, status, seconds, bytes_sent, bytes_received):
+        key = (platform, endpoint)
+        with self.lock:
+            request_key = (platform, endpoint, method, status)
+            self.requests[request_key] = self.requests.get(request_key, 0) + 1
+            self.latencies.setdefault(key, Histogram()).observe(seconds)
+            self.bytes_sent[key] = self.bytes_sent.get(key, 0) + bytes_sent
+            self.bytes_received[key] = self.bytes_received.get(key, 0) + bytes_received
+
+    def count_retry(self, platform, endpoint, reason, count=1):
+        with self.lock:
+            key = (platform, endpoint, reason)
+            self.retries[key] = self.retries.get(key, 0) + count
+
+    def count_error(self, platform, endpoint, error):
+        with self.lock:
+            key = (platform, endpoint, error)
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def add_rate_limit_wait(self, platform, seconds):
+        with self.lock:
+            self.rate_limit_wait[platform] = self.rate_limit_wait.get(platform, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            with self.lock:
+                runs, total, _ = self.phases.get(name, (0, 0.0, 0.0))
+                self.phases[name] = (runs + 1, total + seconds, seconds)
+
+    def to_prometheus(self):
+        with self.lock:
+            lines = [
+                "# HELP hipchannel_http_requests_total API requests by final response status.",
+                "# TYPE hipchannel_http_requests_total counter",
+            ]
+            for (platform, endpoint, method, status), count in sorted(self.requests.items()):
+                labels = format_labels((("platform", platform), ("endpoint", endpoint), ("method", method), ("status", status)))
+                lines.append(f"hipchannel_http_requests_total{{{labels}}} {count}")
+
+            lines += [
+                "# HELP hipchannel_http_request_duration_seconds Time from sending a request to reading its whole response.",
+                "# TYPE hipchannel_http_request_duration_seconds histogram",
+            ]
+            for (platform, endpoint), histogram in sorted(self.latencies.items()):
+                labels = (("platform", platform), ("endpoint", endpoint))
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append(f"hipchannel_http_request_duration_seconds_bucket{{{format_labels(labels + (('le', le),))}}} {cumulative}")
+                lines.append(f"hipchannel_http_request_duration_seconds_sum{{{format_labels(labels)}}} {histogram.total:.6f}")
+                lines.append(f"hipchannel_http_request_duration_seconds_count{{{format_labels(labels)}}} {histogram.count}")
+
+            for name, help_text, values, label_names in (
+                ("hipchannel_http_retries_total", "Requests repeated after a 429, a rejected token or a server error.", self.retries, ("platform", "endpoint", "reason")),
+                ("hipchannel_http_errors_total", "Requests that failed with an exception or an error status.", self.errors, ("platform", "endpoint", "error")),
+                ("hipchannel_http_request_bytes_total", "Request body bytes sent.", self.bytes_sent, ("platform", "endpoint")),
+                ("hipchannel_http_response_bytes_total", "Response body bytes received, after decompression.", self.bytes_received, ("platform", "endpoint")),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for key, value in sorted(values.items()):
+                    lines.append(f"{name}{{{format_labels(zip(label_names, key))}}} {value}")
+
+            lines += [
+                "# HELP hipchannel_rate_limit_wait_seconds_total Time spent waiting on the client-side rate limiter.",
+                "# TYPE hipchannel_rate_limit_wait_seconds_total counter",
+            ]
+            for platform, seconds in sorted(self.rate_limit_wait.items()):
+                lines.append(f"hipchannel_rate_limit_wait_seconds_total{{{format_labels((('platform', platform),))}}} {seconds:.6f}")
+
+            lines += [
+                "# HELP hipchannel_phase_seconds_total Time spent in each phase of a run.",
+                "# TYPE hipchannel_phase_seconds_total counter",
+            ]
+            for phase, (runs, total, last) in sorted(self.phases.items()):
+                lines.append(f"hipchannel_phase_seconds_total{{{format_labels((('phase', phase),))}}} {total:.6f}")
+            lines += [
+                "# HELP hipchannel_phase_runs_total How often each phase has run.",
+                "# TYPE hipchannel_phase_runs_total counter",
+            ]
+            for phase, (runs, total, last) in sorted(self.phases.items()):
+                lines.append(f"hipchannel_phase_runs_total{{{format_labels((('phase', phase),))}}} {runs}")
+            lines += [
+                "# HELP hipchannel_phase_last_seconds How long the most recent run of each phase took.",
+                "# TYPE hipchannel_phase_last_seconds gauge",
+            ]
+            for phase, (runs, total, last) in sorted(self.phases.items()):
+                lines.append(f"hipchannel_phase_last_seconds{{{format_labels((('phase', phase),))}}} {last:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self):
+        with self.lock:
+            endpoints = {}
+
+            def summary(platform, endpoint):
+                if (platform, endpoint) not in endpoints:
+                    histogram = self.latencies.get((platform, endpoint), Histogram())
+                    endpoints[(platform, endpoint)] = {
+                        "platform": platform,
+                        "endpoint": endpoint,
+                        "requests": histogram.count,
+                        "statuses": {},
+                        "retries": {},
+                        "errors": {},
+                        "latency_mean_seconds": histogram.total / histogram.count if histogram.count else None,
+                        "latency_p50_seconds": histogram.quantile(0.5),
+                        "latency_p90_seconds": histogram.quantile(0.9),
+                        "latency_p99_seconds": histogram.quantile(0.99),
+                        "bytes_sent": self.bytes_sent.get((platform, endpoint), 0),
+                        "bytes_received": self.bytes_received.get((platform, endpoint), 0),
+                    }
+                return endpoints[(platform, endpoint)]
+
+            for platform, endpoint in self.latencies:
+                summary(platform, endpoint)
+            for (platform, endpoint, method, status), count in self.requests.items():
+                statuses = summary(platform, endpoint)["statuses"]
+                statuses[str(status)] = statuses.get(str(status), 0) + count
+            for (platform, endpoint, reason), count in self.retries.items():
+                summary(platform, endpoint)["retries"][reason] = count
+            for (platform, endpoint, error), count in self.errors.items():
+                summary(platform, endpoint)["errors"][error] = count
+            return {
+                "since": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started)),
+                "endpoints": sorted(endpoints.values(), key=lambda summary: (summary["platform"], summary["endpoint"])),
+                "rate_limit_wait_seconds": dict(self.rate_limit_wait),
+                "phases": {phase: {"runs": runs, "total_seconds": total, "last_seconds": last}
+                           for phase, (runs, total, last) in sorted(self.phases.items())},
+            }
+
+    def write(self, file_name):
+        # JSON for a .json file name, otherwise the Prometheus text format (e.g. for node_exporter's textfile collector)
+        if file_name.endswith(".json"):
+            content = json.dumps(self.to_json(), indent=2)
+        else:
+            content = self.to_prometheus()
+        temp_file = f"{file_name}.tmp"
+        with open(temp_file, 'w') as f:
+            f.write(content)
+        os.replace(temp_file, file_name)
@@ -0,0 +1,133 @@
+import concurrent.futures
+import json
+import logging
+import os
+import time
+import hipchannel
+
+# Syncs several HipStamp/ChannelAdvisor account pairs in one run. hipchannel keeps its config,
+# sessions, tokens and rate limiters in module globals, so every tenant gets a fresh worker process
+# of its own, started in the tenant's directory so relative state files land there.
+
+# Settings naming files a tenant writes to; no two tenants may share one
+STATE_FILE_SETTINGS = ("LAST_CHECKED_FILE_HIP", "LAST_CHECKED_FILE_CA", "HIPSTAMP_INDEX_FILE", "CHANNEL_ADVISOR_INDEX_FILE",
+                       "INVENTORY_DB_FILE", "TOKEN_CACHE_FILE", "SALE_LEDGER_FILE", "EVENT_LOG_FILE", "METRICS_FILE")
+# Tenants mostly wait on the APIs, so this is not tied to the CPU count
+DEFAULT_WORKERS = 8
+REPORT_COLUMNS = ("tenant", "status", "sale_lines", "seconds", "sale_lines_per_second", "requests", "request_errors", "rate_limit_wait_seconds")
+
+def load_tenants(tenants_file):
+    # tenants_file maps each tenant's name to its config.json, relative to tenants_file.
+    # Returns {name: absolute config path}.
+    try:
+        with open(tenants_file, 'r') as f:
+            tenants = json.load(f)
+    except FileNotFoundError:
+        raise hipchannel.ConfigError(f"Missing {tenants_file} file.")
+    except json.JSONDecodeError as e:
+        raise hipchannel.ConfigError(f"Could not parse {tenants_file}: {e}")
+    if not isinstance(tenants, dict) or not tenants:
+        raise hipchannel.ConfigError(f"{tenants_file} should map tenant names to config files.")
+    base_dir = os.path.dirname(os.path.abspath(tenants_file))
+    return {name: os.path.join(base_dir, config_file) for name, config_file in tenants.items()}
+
+def state_files(config_file):
+    with open(config_file, 'r') as f:
+        config = json.load(f)
+    tenant_dir = os.path.dirname(config_file)
+    files = {}
+    for key in STATE_FILE_SETTINGS:
+        file_name = config.get(key, hipchannel.OPTIONAL_SETTINGS.get(key))
+        if file_name is not None:
+            files[key] = os.path.normpath(os.path.join(tenant_dir, file_name))
+    files["log"] = os.path.join(tenant_dir, "sync_log.log")
+    return files
+
+def check_isolation(tenants):
+    # Two tenants writing the same ledger or snapshot store would apply each other's sales
+    owners = {}
+    for name, config_file in tenants.items():
+        try:
+            files = state_files(config_file)
+        except FileNotFoundError:
+            raise hipchannel.ConfigError(f"Missing {config_file} file for tenant {name}.")
+        except json.JSONDecodeError as e:
+            raise hipchannel.ConfigError(f"Could not parse {config_file} for tenant {name}: {e}")
+        for key, file_name in files.items():
+            if file_name in owners:
+                raise hipchannel.ConfigError(f"Tenants {owners[file_name]} and {name} both use {file_name}. "
+                                             "Give each tenant its own directory.")
+            owners[file_name] = name
+
+def run_tenant(name, config_file, refresh_inventory):
+    # Process pool target. Returns this tenant's row of the report.
+    tenant_dir = os.path.dirname(config_file)
+    os.chdir(tenant_dir)
+    hipchannel.configure_logging(os.path.join(tenant_dir, "sync_log.log"))
+    status = "ok"
+    num_processed = 0
+    started = time.perf_counter()
+    try:
+        engine = hipchannel.SyncEngine(os.path.basename(config_file))
+        num_processed = engine.sync(refresh_inventory=refresh_inventory)
+    except (hipchannel.ConfigError, hipchannel.SyncError) as e:
+        status = f"failed: {e}"
+    except Exception as e:
+        logging.exception(f"Unexpected error syncing tenant {name}")
+        status = f"failed: unexpected error: {e}"
+    seconds = time.perf_counter() - started
+    request_metrics = hipchannel.metrics.to_json()
+    logging.shutdown()
+    return {
+        "tenant": name,
+        "status": status,
+        "sale_lines": num_processed,
+        "seconds": round(seconds, 3),
+        "sale_lines_per_second": round(num_processed / seconds, 1) if seconds else None,
+        "requests": sum(endpoint["requests"] for endpoint in request_metrics["endpoints"]),
+        "request_errors": sum(sum(endpoint["errors"].values()) for endpoint in request_metrics["endpoints"]),
+        "rate_limit_wait_seconds": round(sum(request_metrics["rate_limit_wait_seconds"].values()), 3),
+    }
+
+def sync_tenants(tenants, workers=None, refresh_inventory=False):
+    # Returns (rows, summary) for the report
+    check_isolation(tenants)
+    workers = min(workers or DEFAULT_WORKERS, len(tenants))
+    logging.info(f"Syncing {len(tenants)} tenants with {workers} worker processes.")
+    rows = []
+    started = time.perf_counter()
+    # One task per process, so no tenant inherits another's module state
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as executor:
+        futures = {executor.submit(run_tenant, name, config_file, refresh_inventory): name for name, config_file in tenants.items()}
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                row = future.result()
+            except Exception as e:
+                # The worker process itself died
+                row = {column: None for column in REPORT_COLUMNS}
+                row.update(tenant=name, status=f"failed: worker crashed: {e}")
+            logging.info(f"Tenant {name}: {row['status']}, {row['sale_lines']} sale lines in {row['seconds']} seconds.")
+            rows.append(row)
+    seconds = time.perf_counter() - started
+    rows.sort(key=lambda row: row["tenant"])
+    num_processed = sum(row["sale_lines"] or 0 for row in rows)
+    summary = {
+        "tenants": len(rows),
+        "failed": sum(1 for row in rows if row["status"] != "ok"),
+        "workers": workers,
+        "sale_lines": num_processed,
+        "seconds": round(seconds, 3),
+        "sale_lines_per_second": round(num_processed / seconds, 1) if seconds else None,
+        "requests": sum(row["requests"] or 0 for row in rows),
+    }
+    return rows, summary
+
+def write_report(rows, summary, f):
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in REPORT_COLUMNS]
+    f.write("  ".join(column.ljust(width) for column, width in zip(REPORT_COLUMNS, widths)).rstrip() + "\n")
+    for row in rows:
+        f.write("  ".join(str(row[column]).ljust(width) for column, width in zip(REPORT_COLUMNS, widths)).rstrip() + "\n")
+    f.write(f"\n{summary['tenants']} tenants ({summary['failed']} failed) on {summary['workers']} workers: "
+            f"{summary['sale_lines']} sale lines and {summary['requests']} requests in {summary['seconds']} seconds, "
+            f"{summary['sale_lines_per_second']} sale lines per second.\n")
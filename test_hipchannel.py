@@ -0,0 +1,193 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock
+import http.client
+import requests
+import eventlog
+import hipchannel
+import mockapi
+import records
+import saleledger
+import webhook
+
+class MockAPITestCase(unittest.TestCase):
+    # Points hipchannel at a mockapi server holding the given catalog, with all state in a temporary directory
+    def start_mock(self, listings=(), products=(), sales=(), orders=()):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.stores = mockapi.MockStores(list(listings), list(products), list(sales), list(orders))
+        self.server = mockapi.MockServer(self.stores).start()
+        self.addCleanup(self.server.stop)
+        config = {
+            **self.server.endpoints(),
+            "CHANNEL_ADVISOR_DEVELOPER_KEY": "mock",
+            "HIPSTAMP_API_KEY": "mock",
+            "CHANNEL_ADVISOR_CLIENT_ID": "mock",
+            "CHANNEL_ADVISOR_CLIENT_SECRET": "mock",
+            "CHANNEL_ADVISOR_REFRESH_TOKEN": "mock",
+            "HIPSTAMP_REQUESTS_PER_SECOND": 1000,
+            "CHANNEL_ADVISOR_REQUESTS_PER_SECOND": 1000,
+        }
+        for key in ("LAST_CHECKED_FILE_HIP", "LAST_CHECKED_FILE_CA", "HIPSTAMP_INDEX_FILE", "CHANNEL_ADVISOR_INDEX_FILE",
+                    "INVENTORY_DB_FILE", "SALE_LEDGER_FILE", "EVENT_LOG_FILE"):
+            config[key] = os.path.join(self.temp_dir.name, key.lower())
+        self.config = config
+        self.config_file = os.path.join(self.temp_dir.name, "config.json")
+        with open(self.config_file, 'w') as f:
+            json.dump(config, f)
+        hipchannel.load_config(self.config_file)
+        self.addCleanup(self.unload_config)
+
+    def unload_config(self):
+        hipchannel.reset_state()
+        hipchannel.config = None
+
+class HipStampUpdateTest(MockAPITestCase):
+    # A title that is a substring of more than a page of other titles, with its own listing last
+    TITLE = "US Scott 1"
+
+    def setUp(self):
+        listings = [{'id': 100000 + i, 'name': f"{self.TITLE} variety {i}", 'quantity': 10} for i in range(150)]
+        listings.append({'id': 200000, 'name': self.TITLE, 'quantity': 343})
+        self.start_mock(listings)
+
+    def test_indexed_listing_beyond_first_search_page(self):
+        title_index = {self.TITLE: [records.InventoryItem(200000, self.TITLE, 343)]}
+        hipchannel.update_hipstamp_quantity([records.SaleLine("900000:9000000", self.TITLE, 1)], title_index)
+        self.assertEqual(self.stores.listings[200000]['quantity'], 342)
+
+    def test_unindexed_title_beyond_first_search_page(self):
+        title_index = {}
+        hipchannel.update_hipstamp_quantity([records.SaleLine("900000:9000000", self.TITLE, 2)], title_index)
+        self.assertEqual(self.stores.listings[200000]['quantity'], 341)
+        self.assertEqual(title_index[self.TITLE][0].id, 200000)
+
+    def test_saved_index_is_kept_without_an_index(self):
+        saved = {f"Other {i}": [records.InventoryItem(300000 + i, f"Other {i}", 1)] for i in range(50)}
+        hipchannel.save_title_index(hipchannel.HIPSTAMP_INDEX_FILE, saved)
+        hipchannel.update_hipstamp_quantity([])
+        self.assertEqual(hipchannel.load_title_index(hipchannel.HIPSTAMP_INDEX_FILE), saved)
+        hipchannel.update_hipstamp_quantity([records.SaleLine("900000:9000000", self.TITLE, 1)])
+        index = hipchannel.load_title_index(hipchannel.HIPSTAMP_INDEX_FILE)
+        self.assertEqual(len(index), 51)
+        self.assertEqual(index[self.TITLE][0].quantity, 342)
+
+class TokenCacheTest(MockAPITestCase):
+    def test_cached_token_is_private(self):
+        self.start_mock()
+        token_file = os.path.join(self.temp_dir.name, "token.json")
+        with open(f"{token_file}.tmp", 'w') as f:
+            f.write("left over")
+        with unittest.mock.patch.object(hipchannel, "TOKEN_CACHE_FILE", token_file):
+            hipchannel.get_access_token()
+        if os.name == "posix":
+            self.assertEqual(os.stat(token_file).st_mode & 0o777, 0o600)
+
+class PagingTest(unittest.TestCase):
+    def test_short_hipstamp_pages_continue_until_count(self):
+        params = {'page': 1, 'limit': 100}
+        page = {'count': 120, 'results': [{}] * 50}
+        self.assertEqual(hipchannel.next_hipstamp_page(page, "url", params, 50), ("url", {'page': 2, 'limit': 100}))
+        self.assertIsNone(hipchannel.next_hipstamp_page(page, "url", {'page': 3, 'limit': 100}, 120))
+        self.assertIsNone(hipchannel.next_hipstamp_page({'count': 120, 'results': []}, "url", params, 50))
+        self.assertIsNone(hipchannel.next_hipstamp_page({'results': [{}] * 50}, "url", params, 50))
+
+class RecordsTest(unittest.TestCase):
+    def test_sales_without_an_id_have_no_lines(self):
+        with self.assertLogs(level="ERROR"):
+            sale = records.parse_hipstamp_sale({'created_at': "2024-01-01T00:00:00", 'SaleListings': [{'listing_name': "A", 'quantity': 1}]}, 'created_at')
+        self.assertEqual(sale.lines, [])
+        self.assertEqual(sale.created, "2024-01-01T00:00:00")
+        with self.assertLogs(level="ERROR"):
+            order = records.parse_channeladvisor_sale({'ID': None, 'Items': [{'Title': "A", 'Quantity': 1}]})
+        self.assertEqual(order.lines, [])
+
+class SyncTest(MockAPITestCase):
+    def setUp(self):
+        created = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        orders = [
+            {'ID': 900000, 'CreatedDateUtc': created, 'Items': [{'ID': 1, 'Title': "Listed", 'Quantity': 1}]},
+            {'ID': 900001, 'CreatedDateUtc': created, 'Items': [{'ID': 2, 'Title': "Never listed", 'Quantity': 1}]},
+        ]
+        self.start_mock(listings=[{'id': 100000, 'name': "Listed", 'quantity': 5}], orders=orders)
+
+    def test_unmatched_line_is_set_aside(self):
+        with saleledger.SaleLedger(hipchannel.SALE_LEDGER_FILE) as ledger:
+            self.assertEqual(hipchannel.sync_channeladvisor_sales("token", {}, ledger), 1)
+            self.assertTrue(ledger.has_failed("ChannelAdvisor", "900001:2"))
+            # Nothing left to apply, so the daemon can back off, and the no-match is not logged again
+            self.assertEqual(hipchannel.sync_channeladvisor_sales("token", {}, ledger), 0)
+        self.assertEqual(self.stores.listings[100000]['quantity'], 4)
+        self.assertEqual(hipchannel.get_event_log().count([eventlog.NO_MATCH]), 1)
+
+    def test_watermark_stops_at_a_line_that_failed_to_apply(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.stores.orders[:] = [
+            {'ID': 900002, 'CreatedDateUtc': (now - datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+             'Items': [{'ID': 3, 'Title': "Listed", 'Quantity': 1}]},
+            {'ID': 900003, 'CreatedDateUtc': now.strftime('%Y-%m-%dT%H:%M:%SZ'), 'Items': [{'ID': 4, 'Title': "Other", 'Quantity': 1}]},
+        ]
+        self.stores.listings[100001] = {'id': 100001, 'name': "Other", 'quantity': 5}
+        put = hipchannel.put_hipstamp_quantity
+
+        def fail_listed_once(listing_id, quantity):
+            if listing_id == 100000 and not fail_listed_once.failed:
+                fail_listed_once.failed = True
+                raise requests.ConnectionError("Injected failure")
+            put(listing_id, quantity)
+        fail_listed_once.failed = False
+
+        with saleledger.SaleLedger(hipchannel.SALE_LEDGER_FILE) as ledger:
+            ledger.set_watermark("ChannelAdvisor", (now - datetime.timedelta(hours=2)).isoformat())
+            with unittest.mock.patch.object(hipchannel, "put_hipstamp_quantity", fail_listed_once):
+                self.assertEqual(hipchannel.sync_channeladvisor_sales("token", {}, ledger), 1)
+            self.assertEqual(self.stores.listings[100000]['quantity'], 5)
+            self.assertEqual(hipchannel.sync_channeladvisor_sales("token", {}, ledger), 1)
+        self.assertEqual(self.stores.listings[100000]['quantity'], 4)
+        self.assertEqual(self.stores.listings[100001]['quantity'], 4)
+
+class SnapshotTest(MockAPITestCase):
+    def setUp(self):
+        self.start_mock(products=[{'ID': 500000, 'Title': "Listed", 'TotalAvailableQuantity': 5,
+                                   'UpdateDateUtc': "2024-01-01T00:00:00Z", 'QuantityUpdateDateUtc': "2024-01-01T00:00:00Z"}])
+
+    def test_incremental_snapshot_picks_up_quantity_changes(self):
+        hipchannel.log_current_channeladvisor_inventory("token", full=True)
+        self.stores.products[500000].update(TotalAvailableQuantity=4, QuantityUpdateDateUtc=mockapi.utc_now())
+        hipchannel.log_current_channeladvisor_inventory("token")
+        self.assertEqual([item.quantity for item in hipchannel.load_inventory_snapshot("ChannelAdvisor")], [4])
+
+class WebhookTest(MockAPITestCase):
+    def setUp(self):
+        self.start_mock()
+        self.receiver = webhook.WebhookServer(hipchannel.SyncEngine(self.config_file), "127.0.0.1", 0, "secret").start()
+        self.addCleanup(self.receiver.stop)
+
+    def post(self, path, body, signature):
+        connection = http.client.HTTPConnection(*self.receiver.server_address)
+        try:
+            headers = {} if signature is None else {webhook.SIGNATURE_HEADER: signature}
+            connection.request("POST", path, body=body, headers=headers)
+            return connection.getresponse().status
+        finally:
+            connection.close()
+
+    def test_bad_signatures_are_refused(self):
+        body = json.dumps({'ID': 1, 'Items': []}).encode()
+        self.assertEqual(self.post("/webhooks/channeladvisor", body, None), 401)
+        self.assertEqual(self.post("/webhooks/channeladvisor", body, "sha256=\u00e9"), 401)
+        self.assertEqual(self.post("/webhooks/channeladvisor", body, webhook.sign("secret", body)), 202)
+
+    def test_malformed_lines_are_refused(self):
+        body = json.dumps({'ID': 1, 'Items': ["not an item"]}).encode()
+        self.assertEqual(self.post("/webhooks/channeladvisor", body, webhook.sign("secret", body)), 400)
+
+    def test_port_in_use(self):
+        with self.assertRaises(hipchannel.ConfigError):
+            webhook.WebhookServer(None, "127.0.0.1", self.receiver.server_address[1], "secret")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+import reconcile
+import records
+
+class CompareInventoriesTest(unittest.TestCase):
+    def test_normalized_match_is_shown_when_quantities_agree(self):
+        result = reconcile.compare_inventories([records.InventoryItem("1", "US Scott #1  Mint", 5)],
+                                               [records.InventoryItem("10", "us scott #1 mint", 5)])
+        self.assertEqual(list(result.rows()), [("US Scott #1  Mint", 5, "us scott #1 mint", 5, reconcile.MATCH_NORMALIZED)])
+
+class PlanReconciliationTest(unittest.TestCase):
+    def test_missing_quantity_is_skipped(self):
+        result = reconcile.ComparisonResult()
+        result.append("1", "A", None, "10", "A", 4, reconcile.MATCH_EXACT, 1.0)
+        result.append("2", "B", 3, "20", "B", 5, reconcile.MATCH_EXACT, 1.0)
+        changes = reconcile.plan_reconciliation(result, "ChannelAdvisor")
+        self.assertEqual([change['status'] for change in changes], ["skipped", "planned"])
+        self.assertFalse(changes[0]['set_hipstamp'] or changes[0]['set_channeladvisor'])
+        self.assertEqual(changes[1]['target'], 5)
+
+    def test_equal_quantities_with_pending_sales_are_planned(self):
+        result = reconcile.compare_inventories([records.InventoryItem("1", "A", 5), records.InventoryItem("2", "B", 3)],
+                                               [records.InventoryItem("10", "A", 5), records.InventoryItem("20", "B", 3)], all_matches=True)
+        changes = reconcile.plan_reconciliation(result, "HipStamp", pending_channeladvisor={"A": [("900000:1", 1)]})
+        self.assertEqual([(change['hip_title'], change['target']) for change in changes], [("A", 4)])
+        self.assertTrue(changes[0]['set_hipstamp'] and changes[0]['set_channeladvisor'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hipchannel
+import records
+
+# Receives sale notifications and applies them within seconds instead of at the next poll. A
+# notification is a POST of one sale, or a JSON list of sales, in the shape the platform's sales
+# endpoint returns them, signed with WEBHOOK_SECRET. The daemon's polling sweep still runs and
+# picks up anything that never arrived here or failed to apply.
+
+PLATFORM_PATHS = {
+    "/webhooks/hipstamp": "HipStamp",
+    "/webhooks/channeladvisor": "ChannelAdvisor",
+}
+MAX_BODY_BYTES = 1024 * 1024
+SIGNATURE_HEADER = "X-HipChannel-Signature"
+# Notifications arriving this close together are applied together, so a burst nets per product
+COALESCE_SECONDS = 0.5
+
+def sign(secret, body):
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+def parse_notification(platform, payload):
+    # Raises ValueError if any sale in the notification is malformed; nothing from it is queued then
+    sales = payload if isinstance(payload, list) else [payload]
+    parsed = []
+    for sale in sales:
+        if not isinstance(sale, dict):
+            raise ValueError("each sale must be a JSON object")
+        if platform == "HipStamp":
+            if sale.get('id') is None or not isinstance(sale.get('SaleListings'), list):
+                raise ValueError("HipStamp sales need an id and a SaleListings list")
+            if not all(isinstance(listing, dict) for listing in sale['SaleListings']):
+                raise ValueError("each sale listing must be a JSON object")
+            parsed.append(records.parse_hipstamp_sale(sale, hipchannel.HIPSTAMP_SALE_CREATED_FIELD))
+        else:
+            if sale.get('ID') is None or not isinstance(sale.get('Items'), list):
+                raise ValueError("ChannelAdvisor orders need an ID and an Items list")
+            if not all(isinstance(item, dict) for item in sale['Items']):
+                raise ValueError("each order item must be a JSON object")
+            parsed.append(records.parse_channeladvisor_sale(sale))
+    return parsed
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug(f"Webhook request from {self.client_address[0]}: {format % args}")
+
+    def do_POST(self):
+        server = self.server
+        platform = PLATFORM_PATHS.get(urllib.parse.urlsplit(self.path).path)
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_BODY_BYTES:
+            # The body is left unread, so the connection cannot be reused
+            self.close_connection = True
+            self.respond(400 if length < 0 else 413, {"error": "Bad Content-Length or body too large"})
+            return
+        body = self.rfile.read(length) if length else b""
+        if platform is None:
+            self.respond(404, {"error": "Not Found"})
+            return
+        signature = self.headers.get(SIGNATURE_HEADER)
+        # Compared as bytes: compare_digest refuses str with non-ASCII characters
+        if signature is None or not hmac.compare_digest(sign(server.secret, body).encode(), signature.encode("utf-8", "replace")):
+            logging.warning(f"Rejected {platform} webhook from {self.client_address[0]} with a missing or wrong signature.")
+            self.respond(401, {"error": "Bad signature"})
+            return
+        try:
+            sales = parse_notification(platform, json.loads(body))
+        except ValueError as e:
+            logging.warning(f"Rejected {platform} webhook: {e}")
+            self.respond(400, {"error": str(e)})
+            return
+        queued, duplicates = server.enqueue(platform, sales)
+        self.respond(202, {"queued": queued, "duplicates": duplicates})
+
+    def respond(self, status, payload):
+        payload = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, engine, host="127.0.0.1", port=8787, secret=None):
+        if not secret:
+            raise hipchannel.ConfigError("WEBHOOK_SECRET must be set to receive webhooks.")
+        try:
+            super().__init__((host, port), WebhookHandler)
+        except OSError as e:
+            raise hipchannel.ConfigError(f"Could not listen for webhooks on {host}:{port}: {e}")
+        self.engine = engine
+        self.secret = secret
+        self.queue = queue.Queue()
+        # (platform, ledger_key) of every line waiting in the queue, so a repeated notification is not queued twice
+        self.queued = set()
+        self.queued_lock = threading.Lock()
+        self.ledger = None
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        hipchannel.ensure_config()
+        self.ledger = hipchannel.saleledger.SaleLedger(hipchannel.SALE_LEDGER_FILE)
+        self.threads = [threading.Thread(target=self.serve_forever, daemon=True),
+                        threading.Thread(target=self.apply_queued, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        logging.info(f"Listening for webhooks on {self.server_address[0]}:{self.server_address[1]}.")
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.ledger.close()
+
+    def enqueue(self, platform, sales):
+        # Returns (lines queued, lines skipped as already applied, set aside after a failure or already queued)
+        queued = duplicates = 0
+        received = time.monotonic()
+        with self.queued_lock:
+            for sale in sales:
+                lines = []
+                for line in sale.lines:
+                    key = (platform, line.ledger_key)
+                    if key in self.queued or self.ledger.is_applied(platform, line.ledger_key) or self.ledger.has_failed(platform, line.ledger_key):
+                        duplicates += 1
+                    else:
+                        self.queued.add(key)
+                        lines.append(line)
+                if lines:
+                    self.queue.put((platform, lines, received))
+                    queued += len(lines)
+        return queued, duplicates
+
+    def apply_queued(self):
+        while not self.stop_event.is_set():
+            try:
+                batch = [self.queue.get(timeout=1)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + COALESCE_SECONDS
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.apply(batch)
+
+    def apply(self, batch):
+        lines_by_platform = {"HipStamp": [], "ChannelAdvisor": []}
+        for platform, lines, _ in batch:
+            lines_by_platform[platform].extend(lines)
+        oldest = min(received for _, _, received in batch)
+        try:
+            num_processed = self.engine.apply_sale_lines(lines_by_platform, self.ledger)
+            logging.info(f"Applied {num_processed} webhook sale lines, {time.monotonic() - oldest:.2f} seconds after the oldest arrived.")
+        except Exception as e:
+            # Whatever did not go through stays out of the ledger for the polling sweep to retry
+            logging.error(f"Could not apply webhook sales, leaving them for the next sweep: {e}")
+        finally:
+            with self.queued_lock:
+                for platform, lines in lines_by_platform.items():
+                    for line in lines:
+                        self.queued.discard((platform, line.ledger_key))